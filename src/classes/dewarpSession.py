@@ -0,0 +1,337 @@
+# dewarpSession.py
+# Dewarps a stream of images against a set of named reference images
+
+import copy
+import numpy as np
+from collections import namedtuple
+from typing import Union, List, Dict, Hashable, NoReturn, Any
+from dewarper import Dewarper
+from featureCache import FeatureCache
+
+# Define type hints for the OpenCV image
+CV_Image = 'np.ndarray[int]'
+
+
+class DewarpSession():
+	"""
+	Owns the feature detector, the matcher, and the reference features of a
+	set of named reference images, so many images can be dewarped against
+	them without any per image setup. Each reference is prepared once by
+	add_reference(): its keypoints are detected and, in shared index mode,
+	its FLANN index is built. Each call of dewarp() then only detects and
+	matches the keypoints of the image.
+
+	Attributes
+	----------
+	cache : FeatureCache
+		Stores the reference features & FLANN indexes
+
+	options : dict
+		The Dewarper constructor arguments shared by every reference, e.g.
+		{'detector': 'orb', 'grayscale': True}
+
+	references : dict
+		Key : hashable
+			The name of a reference image, e.g. a page number
+		Val : Dewarper
+			A Dewarper holding the reference image, masks, and features
+
+	sifter : cv.Feature2D
+		The feature detector shared by every reference
+
+	fanner : cv.DescriptorMatcher
+		The matcher shared by every reference
+
+	dewarper : Dewarper
+		The Dewarper of the last image dewarped, with its homography,
+		quality, and matches
+
+	classifier : Dewarper
+		A Dewarper without images, which detects the keypoints of the
+		images classified by classify()
+
+	voters : dict
+		Key : hashable
+			The name of a reference image
+		Val : Dewarper
+			The Dewarper holding the features of the whole reference image,
+			which classify() votes against. It's the reference's own, 
+			unless the reference is masked.
+	"""
+
+	Classification = namedtuple('Classification', ['name', 'votes', 'features'])
+	"""
+	The reference an image was identified as by classify(), or None; the
+	votes cast for each reference, {name: votes}; and the keypoints & 
+	descriptors of the whole image, a Dewarper.Kpd, which get_dewarper()
+	can reuse
+	"""
+
+	MIN_VOTES = 20  # The min votes of an identified reference
+	VOTE_MARGIN = 1.5  # The min ratio of the winning votes to the runner-up's
+
+	def __init__(self,
+				 refs: Dict[Hashable, Union[str, CV_Image]]=None,
+				 cache: FeatureCache=None,
+				 shared_index: bool=True,
+				 **options: Any
+	) -> NoReturn:
+		"""
+		The constructor
+
+		Parameters
+		----------
+		refs : dict
+			Optional reference images or path/to/reference.images, by name.
+			More can be added by add_reference().
+
+		cache : FeatureCache
+			Optional store of the reference features. A memory-only cache
+			is created if None.
+
+		shared_index : bool
+			If True, each reference's FLANN index is built once and shared
+			by every image matched against it. See Dewarper.
+
+		**options
+			Other Dewarper constructor arguments, e.g. detector='orb',
+			grayscale=True, max_keypoints=500, fallbacks=('identity',)
+		"""
+		self.cache = FeatureCache() if cache is None else cache
+		self.options = dict(options, shared_index=shared_index)
+		self.references = {}
+		self.voters = {}
+		self.dewarper = None
+
+		template = Dewarper(cache=self.cache, **self.options)
+		self.sifter = template.sifter
+		self.fanner = template.fanner
+
+		self.classifier = template
+
+		if refs is not None:
+			for name, ref in refs.items():
+				self.add_reference(name, ref)
+
+
+	def add_reference(self,
+					  name: Hashable,
+					  ref: Union[str, CV_Image],
+					  ref_mask: 'np.ndarray[int]'=None,
+					  img_mask: 'np.ndarray[int]'=None
+	) -> Dewarper:
+		"""
+		Prepares a reference image: detects its keypoints and, in shared
+		index mode, builds its FLANN index. Replaces any reference with the
+		same name. The keypoints of a masked reference are also detected 
+		over the whole image, for classify().
+
+		Parameters
+		----------
+		name : hashable
+			The name of the reference, e.g. a page number
+
+		ref : str or ndarray
+			The reference image, or path/to/the/reference.image
+
+		ref_mask : ndarray
+			Optional mask of where reference keypoints are detected, see
+			Dewarper.mask_from_boxes()
+
+		img_mask : ndarray
+			Optional mask of where keypoints are detected in the images
+			dewarped against this reference
+
+		Returns
+		-------
+		Dewarper
+			The prepared Dewarper of the reference
+		"""
+		voter = None
+
+		# The whole reference first, then the masked reference, if any
+		for mask in ([None] if ref_mask is None else [None, ref_mask]):
+			d = Dewarper(ref, cache=self.cache, **self.options)
+			d.sifter = self.sifter
+			d.fanner = self.fanner
+			d.ref_mask = mask
+
+			d.sift('ref')
+			if d.shared_index:
+				d.cache.get_index(d.ref_key, d.kpd_ref.des, d.index_params)
+
+			if voter is None:
+				voter = d
+
+		d.img_mask = img_mask
+		self.references[name] = d
+		self.voters[name] = voter
+
+		return d
+
+
+	def get_dewarper(self,
+					 name: Hashable,
+					 img: Union[str, CV_Image]=None,
+					 seed: 'np.ndarray[float]'=None,
+					 features: 'Dewarper.Kpd'=None
+	) -> Dewarper:
+		"""
+		Returns a Dewarper for an image and a prepared reference. It's a
+		shallow copy of the reference's Dewarper, so it shares the detector,
+		matcher, masks, and reference features, and is created at no cost.
+
+		Parameters
+		----------
+		name : hashable
+			The name of the reference
+
+		img : str or ndarray
+			Optional skewed image, or path/to/the/skewed.image
+
+		seed : ndarray
+			Optional img --> ref transformation matrix to try first, see
+			Dewarper
+
+		features : Dewarper.Kpd
+			Optional keypoints & descriptors of the whole image, e.g. from 
+			classify(), which are reused instead of being detected again. 
+			They're ignored if the reference has an image mask.
+
+		Returns
+		-------
+		Dewarper
+			A Dewarper ready to dewarp the image
+		"""
+		if name not in self.references:
+			raise KeyError(f"There's no reference named {name!r}, add it with add_reference()")
+
+		d = copy.copy(self.references[name])
+		d.seed = seed
+
+		if img is not None:
+			d.set_image(img)
+
+		if features is not None and d.img_mask is None:
+			d.kpd_img = features
+
+		return d
+
+
+	def dewarp(self,
+			   img: Union[str, CV_Image],
+			   name: Hashable,
+			   dst: CV_Image=None,
+			   regions: List['Box']=None,
+			   seed: 'np.ndarray[float]'=None
+	) -> Union[CV_Image, List[CV_Image]]:
+		"""
+		Dewarps an image against a prepared reference. The Dewarper used is
+		stored in self.dewarper.
+
+		Parameters
+		----------
+		img : str or ndarray
+			The skewed image, or path/to/the/skewed.image
+
+		name : hashable
+			The name of the reference
+
+		dst : ndarray
+			Optional preallocated output for the dewarped image, see
+			Dewarper.dewarp_image()
+
+		regions : list[Box]
+			If given, only these regions of the reference frame are dewarped,
+			see Dewarper.dewarp_regions()
+
+		seed : ndarray
+			Optional img --> ref transformation matrix to try first, see
+			Dewarper
+
+		Returns
+		-------
+		ndarray or list[ndarray]
+			The dewarped image, or the dewarped regions if regions are given
+		"""
+		self.dewarper = self.get_dewarper(name, img, seed)
+
+		return self.dewarper.dewarp(dst=dst, regions=regions)
+
+
+	def classify(self, 
+				 img: Union[str, CV_Image], 
+				 names: List[Hashable]=None
+	) -> 'DewarpSession.Classification':
+		"""
+		Identifies which reference an image shows, by descriptor voting over
+		the prepared reference features, before any homography is fit. The
+		image keypoints are matched against every reference; each keypoint
+		that passes the ratio test votes for the reference holding its 
+		closest match. Content printed on several references, e.g. page 
+		headers, splits its votes, while the content unique to a reference
+		decides. The image keypoints are detected without a mask, but 
+		otherwise like those of a dewarped image. They're voted against 
+		the features of the whole reference images, even when the
+		references are masked.
+
+		The winner is only identified if it has at least MIN_VOTES votes, 
+		and VOTE_MARGIN times the runner-up's; a blank or foreign page 
+		is identified as None.
+
+		Parameters
+		----------
+		img : str or ndarray
+			The skewed image, or path/to/the/skewed.image
+
+		names : list
+			Optional names of the candidate references, all if None
+
+		Returns
+		-------
+		DewarpSession.Classification
+			The name of the identified reference, or None, the votes for 
+			each candidate reference, and the image features
+		"""
+		if names is None:
+			names = list(self.references)
+
+		d = copy.copy(self.classifier)
+		d.set_image(img)
+		kp, des = d.detect(d.img)
+
+		# The distance to each voter's close match in each reference
+		closest = np.full((len(names), 0 if des is None else len(des)), np.inf)
+
+		for j, name in enumerate(names):
+			ref = self.voters[name]
+			des_r = ref.kpd_ref.des
+
+			if des is None or des_r is None or len(des) < 2 or len(des_r) < 2:
+				continue
+			elif ref.index_params is not None:
+				index = self.cache.get_index(ref.ref_key, des_r, ref.index_params)
+				idx, dist = index.knnSearch(des, 2, params=ref.search_params)
+				dist = dist.astype('float64')  # LSH returns int Hamming distances
+				if ref.detector == 'sift':
+					dist = np.sqrt(dist)  # FLANN returns squared L2 distances
+				dist[(idx < 0).any(axis=1)] = np.inf
+			else:
+				matches = self.fanner.knnMatch(des, des_r, k=2)
+				dist = np.array([ [m.distance for m in row] for row in matches ])
+
+			close = dist[:, 0] < ref.MATCH_RATIO * dist[:, 1]
+			closest[j, close] = dist[close, 0]
+
+		voters = np.isfinite(closest).any(axis=0)
+		counts = np.zeros(len(names), dtype='int64')
+		if voters.any():
+			counts = np.bincount(closest[:, voters].argmin(axis=0), minlength=len(names))
+		votes = dict(zip(names, counts.tolist()))
+
+		ranked = sorted(votes.values(), reverse=True) + [0, 0]
+		name = None
+		if ranked[0] >= self.MIN_VOTES and ranked[0] >= self.VOTE_MARGIN * ranked[1]:
+			name = names[int(counts.argmax())]
+
+		return self.Classification(name, votes, Dewarper.Kpd(kp, des))
@@ -1,8 +1,12 @@
+import copy
 import cv2 as cv 
 import numpy as np
 from collections import namedtuple
+from itertools import chain
+from operator import attrgetter
 from matplotlib import pyplot as plt
 from typing import Union, List, Tuple, Dict, NoReturn
+from featureCache import FeatureCache
 
 # Define type hints for the OpenCV contour and OpenCV image 
 CV_Contour = 'np.ndarray[np.ndarray[np.ndarray[int]]]'
@@ -22,10 +26,51 @@ class Dewarper():
 	descriptors. Each row in 'des' is the set of descriptors for a single kp
 	"""
 
+	Quality = namedtuple('Quality', ['matches', 'inliers', 'inlier_ratio', 
+									 'reprojection_error', 'determinant', 'condition'])
+	"""
+	The quality of a homography, see measure_homography(). Contains the 
+	number of close matches, the number & fraction of them that M maps to 
+	within 5 px of their reference keypoints, the RMS reprojection error of
+	those inliers in px, and the determinant & condition number of the
+	linear part of M, i.e. the page's change of area & its anisotropy.
+	"""
+
+	BACKENDS = {
+		'sift': ('SIFT_create', 
+				 dict(nfeatures=0, nOctaveLayers=3, contrastThreshold=0.04, 
+					  edgeThreshold=10, sigma=1.6),
+				 dict(algorithm=1, trees=5)),  # FLANN KD tree, L2 distance
+		'orb': ('ORB_create',
+				dict(nfeatures=5000, scaleFactor=1.2, nlevels=8, 
+					 edgeThreshold=31, fastThreshold=20),
+				None),  # Brute force, Hamming distance
+		'akaze': ('AKAZE_create',
+				  dict(threshold=0.001, nOctaves=4, nOctaveLayers=4),
+				  dict(algorithm=6, table_number=6, key_size=12, 
+					   multi_probe_level=1)),  # FLANN LSH, Hamming distance
+	}
+	"""
+	The feature detector backends. Maps a backend name to the name of its
+	OpenCV factory function, the detector parameters, and the FLANN index 
+	parameters used to match its descriptors, or None for a brute force 
+	matcher. SIFT is the most accurate; ORB and AKAZE have binary 
+	descriptors and are several times faster.
+	"""
+
 
 	def __init__(self, 
 				 ref: Union[str, 'np.ndarray[int]']=None, 
-				 img: Union[str, 'np.ndarray[int]']=None
+				 img: Union[str, 'np.ndarray[int]']=None,
+				 cache: 'FeatureCache'=None,
+				 shared_index: bool=False,
+				 grayscale: bool=False,
+				 ref_mask: 'np.ndarray[int]'=None,
+				 max_keypoints: int=0,
+				 detector: str='sift',
+				 pyramid_scale: float=None,
+				 seed: 'np.ndarray[float]'=None,
+				 fallbacks: Tuple[str]=()
 	 ) -> NoReturn:
 		"""
 		The constructor
@@ -39,23 +84,114 @@ class Dewarper():
 		img : str or ndarray
 			path/to/the/WARPED.image	
 			or the skewed image to be dewarped
+
+		cache : FeatureCache
+			Optional store of reference keypoint descriptors. If given, the 
+			reference features are computed once per reference image and
+			reused by every Dewarper sharing the cache.
+
+		shared_index : bool
+			If True, match against a FLANN index over the reference 
+			descriptors that is built once and shared through the cache, 
+			instead of rebuilding the search tree on every match.
+
+		grayscale : bool
+			If True, the skewed image is kept as a single channel grayscale 
+			image, so it is dewarped without any color conversions and
+			'dewarped' & 'dewarped_gray' are the same image.
+
+		ref_mask : ndarray
+			Optional uint8 mask the size of the reference image. Reference
+			keypoints are only detected where the mask is nonzero, e.g. 
+			around the table borders and headers, which are the same on 
+			every exam edition. See mask_from_boxes().
+
+		max_keypoints : int
+			If nonzero, keep only this many of the strongest keypoints of 
+			each image.
+
+		detector : str
+			The feature detector backend, one of the keys of BACKENDS:
+			{'sift', 'orb', 'akaze'}. The brute force matcher of 'orb' 
+			doesn't use an index, so 'shared_index' has no effect with it.
+
+		pyramid_scale : float
+			If given, e.g. 0.5, keypoints are detected on images downscaled
+			by this factor, and the coarse homography is then refined on the
+			full resolution images by ECC, see refine_homography(). 
+
+		seed : ndarray
+			Optional img --> ref transformation matrix of a similarly 
+			distorted image, e.g. the previous page from the same scanner. 
+			If the image dewarped by the seed is aligned with the reference,
+			the seed is used without matching any features; otherwise the 
+			seed selects the inliers of the homography, see get_homography().
+
+		fallbacks : tuple[str]
+			What to try, in order, if the homography is missing or its 
+			quality is unacceptable, see fall_back(). Any of 'ratio' 
+			(relaxed ratio test), a detector backend, e.g. 'orb', or 
+			'identity' (don't dewarp).
 		"""
+		if detector not in self.BACKENDS:
+			raise ValueError(f"The 'detector' param must be one of {set(self.BACKENDS)}")
+		for fallback in fallbacks:
+			if fallback not in ('ratio', 'identity', *self.BACKENDS):
+				raise ValueError(f"The 'fallbacks' must be 'ratio', 'identity', or one of {set(self.BACKENDS)}")
 
 		self.MIN_MATCH_COUNT = 4
 		self.MATCH_RATIO = 0.7
+		self.knn = None  # The (ref_idx, img_idx, distance) arrays of the k nearest neighbors
+		self.good = None  # The (ref_idx, img_idx, distance) arrays of the close matches
 		self.matches = []
 		self.good_matches = []
 		self.transformation_matrix = None  # the transform matrix act --> ref, [ref] = M[act]
 		self.homo_mask = None  # the homography mask
 		self.perspective_transform = None  # the vector transform of the image bounding vectors
 
-		self.sifter = cv.SIFT_create()  # An obj that implements the SIFT algorithm
+		# The detector parameters are stored so they can key the feature cache
+		factory, self.detector_params, self.index_params = self.BACKENDS[detector]
+		create = getattr(cv, factory, None)
+		if create is None:
+			raise ValueError(f"OpenCV {cv.__version__} has no {factory}(), choose another 'detector'")
+		self.detector = detector
+		self.sifter = create(**self.detector_params)  # An obj that implements the detection algorithm
+		self.cache = cache  # Stores reference keypoint descriptors across pages and runs
+		self.ref_key = None  # The cache key of the reference features
+		self.shared_index = shared_index
+		self.grayscale = grayscale  # Dewarp the grayscale image instead of the original
+		self.ref_mask = ref_mask  # Where to detect reference keypoints, None for everywhere
+		self.img_mask = None  # Where to detect image keypoints, None for everywhere
+		self.max_keypoints = max_keypoints  # Keypoints kept per image, 0 for all
+		self.pyramid_scale = pyramid_scale  # Downscaling of the detection images, None for full size
+		self.ecc_criteria = (cv.TERM_CRITERIA_EPS | cv.TERM_CRITERIA_COUNT, 10, 1e-3)
+		self.alignment = []  # The (dx, dy, score) of each landmark, see is_aligned()
+		self.seed = seed  # An img --> ref transform to try first, None to always match features
+		self.SEED_INLIER_RATIO = 0.5  # The min fraction of close matches consistent with the seed
+		self.homography_source = None  # How the transform was found: 'seed', 'seed_refined', 'ransac', or a fallback
+		self.quality = None  # The Quality of the transform, see measure_homography()
+		self.fallbacks = fallbacks
+		self.RELAXED_MATCH_RATIO = 0.8  # The ratio test of the 'ratio' fallback
+
+		# The limits of an acceptable homography, see is_acceptable()
+		self.MIN_INLIERS = 20
+		self.MIN_INLIER_RATIO = 0.3
+		self.MAX_REPROJECTION_ERROR = 2.0  # px
+		self.DETERMINANT_RANGE = (0.5, 2.0)
+		self.MAX_CONDITION = 1.5
+
+		if self.index_params is None:
+			self.shared_index = False
+
+		if self.shared_index and cache is None:
+			self.cache = FeatureCache()
 
 		self.ref = None # The reference image
-		self.og  = None # The skewed image to be dewarped
+		self.og  = None # The skewed image to be dewarped, the same as img in grayscale mode
 		self.img = None  # A copy for internal processing
 		self.dewarped = None  # The dewarped/deskewed image
 		self.dewarped_gray = None  # The 2D dewarped/deskewed image, used for validation
+		self.dewarped_regions = []  # Dewarped regions of the reference frame, see dewarp_regions()
 
 		# Handle strings or images as constructor args
 		if isinstance(ref, str):
@@ -65,7 +201,9 @@ class Dewarper():
 		else:
 			pass
 
-		if isinstance(img, str):
+		if isinstance(img, str) and grayscale:
+			self.og = cv.imread(img, cv.IMREAD_GRAYSCALE)
+		elif isinstance(img, str):
 			self.og = cv.imread(img)  
 		elif isinstance(img, np.ndarray):
 			self.og = img
@@ -81,21 +219,27 @@ class Dewarper():
 		else:
 			self.img = self.og
 
+		if grayscale:
+			self.og = self.img
+
 		self.kpd_ref = self.Kpd(None, None)  # Keypoint descriptors
 		self.kpd_img = self.Kpd(None, None)
 
-		# FANN parameters
-		ALG = 1  # The Flann Index KD Tree algorithm
-		index_params = dict(algorithm=ALG, trees=5)
-		search_params = dict(checks=50)
-		self.fanner = cv.FlannBasedMatcher(index_params, search_params)
+		# FANN parameters, a brute force Hamming matcher if there's no index
+		self.search_params = dict(checks=50)
+		if self.index_params is None:
+			self.fanner = cv.BFMatcher(cv.NORM_HAMMING)
+		else:
+			self.fanner = cv.FlannBasedMatcher(self.index_params, self.search_params)
 
 
 	def load(self, path: str, flag: str) -> NoReturn:
 		"""
 		Loads an image file as either a reference or skewed img to be dewarped.
 		Accepts PNG, JPG, TIF, converts to grayscale, & stores it in either
-		self.ref or self.img
+		self.ref or self.img. In grayscale mode the skewed image is decoded 
+		directly to grayscale and also stored in self.og. The keypoints of
+		the previous image or reference are cleared.
 
 		Parameters
 		----------
@@ -106,21 +250,240 @@ class Dewarper():
 			Whether to store the file as the ref or img to be dewarped. 
 			Accepts values of {'ref', 'r', 'img', 'i'}
 		"""	
+		if flag in ('img', 'i') and self.grayscale:
+			self.img = cv.imread(path, cv.IMREAD_GRAYSCALE)
+			self.og = self.img
+			self.kpd_img = self.Kpd(None, None)
+			return
+
 		tmp = cv.imread(path)
 
 		if flag in ('ref', 'r'): 
 			self.ref = cv.cvtColor(tmp, cv.COLOR_BGR2GRAY)
+			self.kpd_ref = self.Kpd(None, None)
 		elif flag in ('img', 'i'): 
 			self.og = tmp
 			self.img = cv.cvtColor(tmp, cv.COLOR_BGR2GRAY)
+			self.kpd_img = self.Kpd(None, None)
 		else: 
 			raise ValueError("The 'flag' param must be one of {'ref', 'r', 'img', 'i'}")
 
 
+	def mask_from_boxes(self, 
+						boxes: List['Box'], 
+						margin: int=15, 
+						header: int=66
+	) -> 'np.ndarray[int]':
+		"""
+		Creates a keypoint detection mask covering the borders and headers of
+		rectangular regions of the reference image, e.g. the Scoring Key 
+		boxes. Those landmarks are printed identically on every exam, while 
+		the rest of the page (answers, category marks, body text) differs.
+
+		Parameters
+		----------
+		boxes : list[Box]
+			The regions, anything with x, y, w, h attributes
+
+		margin : int
+			The distance in pixels the mask extends to either side of each
+			box border
+
+		header : int
+			The height in pixels of the header at the top of each box
+
+		Returns
+		-------
+		ndarray
+			A uint8 mask the size of the reference image: 255 inside the 
+			landmark regions, 0 elsewhere
+		"""
+		mask = np.zeros(self.ref.shape[0:2], dtype='uint8')
+
+		for b in boxes:
+			cv.rectangle(mask, (b.x, b.y), (b.x+b.w, b.y+b.h), 255, 2*margin)
+			mask[b.y:b.y+header, b.x:b.x+b.w] = 255
+
+		return mask
+
+
+	def is_aligned(self, 
+				   boxes: List['Box']=None, 
+				   search: int=4, 
+				   min_score: float=0.8,
+				   margin: int=15, 
+				   header: int=66,
+				   M: 'np.ndarray[float]'=None
+	) -> bool:
+		"""
+		A cheap check of whether the skewed image is already aligned with the
+		reference, e.g. a page of a digital pdf, so dewarping can be skipped.
+		The top border & header and the bottom border of each box are 
+		template matched against the image within 'search' pixels of their
+		reference positions. The boxes are spread over the page, so a 
+		rotation or scaling offsets some of them. Stores the (dx, dy, score)
+		of each landmark in self.alignment.
+
+		Parameters
+		----------
+		boxes : list[Box]
+			The regions whose borders are matched, anything with x, y, w, h
+			attributes, e.g. the 'tables' of a ScoreKey. If None, the borders
+			of the whole page are matched.
+
+		search : int
+			The max offset in pixels searched in each direction
+
+		min_score : float
+			The min normalized correlation of every landmark
+
+		margin : int
+			The distance in pixels each landmark extends to either side of 
+			the box border
+
+		header : int
+			The height in pixels of the header at the top of each box
+
+		M : ndarray
+			Optional img --> ref transformation matrix. If given, checks
+			whether the image dewarped by M is aligned with the reference.
+			Only the windows around the landmarks are dewarped.
+
+		Returns
+		-------
+		bool
+			True if every landmark is found at its reference position, 
+			i.e. within half a pixel, with at least 'min_score'. Blank 
+			landmarks are ignored.
+		"""
+		self.alignment = []
+
+		if self.img is None or (M is None and self.img.shape != self.ref.shape):
+			return False
+
+		if not boxes:
+			h, w = self.ref.shape
+			m = margin + search
+			rects = [ (m, m, w - 2*m, h - 2*m - header) ]
+		else:
+			rects = [ (b.x, b.y, b.w, b.h) for b in boxes ]
+
+		for x, y, w, h in rects:
+			landmarks = ( (x - margin, y - margin, w + 2*margin, header + margin),  # top & header
+						  (x - margin, y + h - margin, w + 2*margin, 2*margin) )  # bottom
+
+			for lx, ly, lw, lh in landmarks:
+				template = self.ref[ly:ly+lh, lx:lx+lw]
+				if template.min() == template.max():
+					continue  # A blank landmark matches anywhere
+
+				x0, y0 = lx - search, ly - search
+				size = (lw + 2*search, lh + 2*search)
+
+				if M is None:
+					window = self.img[y0:y0+size[1], x0:x0+size[0]]
+				else:
+					T = np.array([ [1, 0, -x0], [0, 1, -y0], [0, 0, 1] ], dtype='float64')
+					window = cv.warpPerspective(self.img, T @ M, size)
+
+				result = cv.matchTemplate(window, template, cv.TM_CCOEFF_NORMED)
+				_, score, _, (dx, dy) = cv.minMaxLoc(result)
+				self.alignment.append( (dx - search, dy - search, score) )
+
+		return len(self.alignment) > 0 and all( 
+			dx == 0 and dy == 0 and score >= min_score 
+			for dx, dy, score in self.alignment
+		)
+
+
+	def detect(self, 
+			   image: CV_Image, 
+			   mask: 'np.ndarray[int]'=None
+	) -> Tuple[Tuple['cv.KeyPoint'], 'np.ndarray']:
+		"""
+		Detects the keypoints & computes the descriptors of an image, keeping
+		only the 'max_keypoints' keypoints with the strongest response.
+
+		The cap is applied here rather than through SIFT's nfeatures, which 
+		retains the strongest keypoints before applying the mask and so 
+		leaves only a handful inside a small mask.
+
+		If 'pyramid_scale' is set, the image & mask are downscaled before 
+		detection and the keypoints are mapped back to full resolution 
+		coordinates, so matching and get_homography() are unaffected.
+
+		Parameters
+		----------
+		image : ndarray
+			A grayscale image
+
+		mask : ndarray
+			Optional uint8 mask; keypoints are only detected where nonzero
+
+		Returns
+		-------
+		tuple(tuple[cv.KeyPoint], ndarray)
+			The keypoints and their descriptors, 1 row per keypoint
+		"""
+		scale = self.pyramid_scale
+
+		if scale:
+			image = cv.resize(image, None, fx=scale, fy=scale, interpolation=cv.INTER_AREA)
+			if mask is not None:
+				size = (image.shape[1], image.shape[0])
+				mask = cv.resize(mask, size, interpolation=cv.INTER_NEAREST)
+
+		kp, des = self.sifter.detectAndCompute(image, mask=mask)
+
+		if self.max_keypoints and len(kp) > self.max_keypoints:
+			response = np.array([k.response for k in kp])
+			best = np.argsort(-response, kind='stable')[:self.max_keypoints]
+			kp = tuple(kp[j] for j in best)
+			des = des[best]
+
+		if scale:
+			kp = tuple(
+				cv.KeyPoint((k.pt[0] + 0.5)/scale - 0.5, (k.pt[1] + 0.5)/scale - 0.5, 
+							k.size/scale, k.angle, k.response, k.octave, k.class_id)
+				for k in kp
+			)
+
+		return kp, des
+
+
+	def set_image(self, img: Union[str, 'np.ndarray[int]']) -> NoReturn:
+		"""
+		Stores the skewed image to be dewarped in self.og, and its grayscale
+		version in self.img, and clears the keypoints of any previous image.
+
+		Parameters
+		----------
+		img : str or ndarray
+			str - path to an image file
+			ndarray - the skewed image 
+		"""
+		if isinstance(img, str):
+			self.load(img, 'img') 
+		elif isinstance(img, np.ndarray) and len(img.shape) == 3:
+			self.og = img
+			self.img = cv.cvtColor(self.og, cv.COLOR_BGR2GRAY)
+		elif isinstance(img, np.ndarray):
+			self.og = img
+			self.img = img
+
+		if self.grayscale:
+			self.og = self.img
+
+		self.kpd_img = self.Kpd(None, None)  # The previous image's keypoints
+
+
 	def sift(self, flag: str=None) -> NoReturn:
 		"""
 		Performs the SIFT algorithm, then stores the keypoints and descriptors
 		into 'self.kpd_ref' or 'self.kpd_img', depending on the flag value.
+		If the Dewarper has a cache, reference features are read from it 
+		instead of being recomputed. Keypoints are only detected inside
+		'ref_mask' and 'img_mask', if set.
 
 		Parameters
 		----------
@@ -130,11 +493,26 @@ class Dewarper():
 		"""
 
 
-		if flag in ('ref', 'r'): 
-			kp, des = self.sifter.detectAndCompute(self.ref, mask=None)
+		if flag in ('ref', 'r') and self.cache is not None:
+			params = dict(self.detector_params, detector=self.detector,
+						  max_keypoints=self.max_keypoints, 
+						  pyramid_scale=self.pyramid_scale)
+			key = self.cache.key(self.ref, params, self.ref_mask)
+			cached = self.cache.get(key)
+			self.ref_key = key
+
+			if cached is None:
+				kp, des = self.detect(self.ref, self.ref_mask)
+				self.cache.put(key, kp, des)
+			else:
+				kp, des = cached
+
+			self.kpd_ref = self.Kpd(kp, des)
+		elif flag in ('ref', 'r'): 
+			kp, des = self.detect(self.ref, self.ref_mask)
 			self.kpd_ref = self.Kpd(kp, des)
 		elif flag in ('img', 'i'): 
-			kp, des = self.sifter.detectAndCompute(self.img, mask=None)
+			kp, des = self.detect(self.img, self.img_mask)
 			self.kpd_img = self.Kpd(kp, des)
 		else: 
 			raise ValueError("The 'flag' param must be one of {'ref', 'r', 'img', 'i'}")
@@ -142,8 +520,15 @@ class Dewarper():
 
 	def fann(self, k: int=2) -> NoReturn:
 		"""
-		Finds k nearest neighbors using the FANN algorithm, then appends the
-		matches to self.matches
+		Finds k nearest neighbors using the FANN algorithm, or brute force for
+		the 'orb' backend, then appends the matches to self.matches. The LSH
+		index of the 'akaze' backend can find fewer than k neighbors for a 
+		descriptor; those descriptors are dropped.
+
+		In shared index mode the image descriptors are searched in the cached
+		index over the reference descriptors. The resulting matches are
+		stored with the same orientation as knnMatch(des_r, des_i): queryIdx
+		indexes the reference keypoints and trainIdx the image keypoints.
 
 		Parameters
 		----------
@@ -152,27 +537,96 @@ class Dewarper():
 		"""
 		# Descriptors of the ref and img keypoints
 		des_r, des_i = self.kpd_ref.des, self.kpd_img.des
-		self.matches = self.fanner.knnMatch(des_r, des_i, k=k)
+
+		if des_r is None or des_i is None or len(des_r) < k or len(des_i) < k:
+			self.matches = []  # Too few keypoints, e.g. a blank image
+		elif self.shared_index:
+			index = self.cache.get_index(self.ref_key, des_r, self.index_params)
+			idx, dist = index.knnSearch(des_i, k, params=self.search_params)
+			if self.detector == 'sift':
+				dist = np.sqrt(dist)  # FLANN returns squared L2 distances
+
+			# The matches are only converted to cv.DMatch if they're accessed
+			found = (idx >= 0).all(axis=1)
+			img_idx = np.repeat(np.arange(len(idx)), k).reshape(-1, k)
+			self.knn = (idx[found], img_idx[found], dist[found].astype('float32'))
+			self._matches = None
+		else:
+			matches = self.fanner.knnMatch(des_r, des_i, k=k)
+			if self.detector == 'akaze':
+				matches = [ m for m in matches if len(m) == k ]
+			self.matches = matches
+
+
+	@property
+	def matches(self) -> List[Tuple['cv.DMatch']]:
+		"""
+		The k nearest neighbor matches found by fann(), a tuple of cv.DMatch
+		per matched descriptor. Built from self.knn when first accessed; 
+		filtering and the homography only use the arrays.
+		"""
+		if self._matches is None:
+			ref_idx, img_idx, dist = (a.tolist() for a in self.knn)
+			self._matches = [
+				tuple( cv.DMatch(*m) for m in zip(r, i, d) ) 
+				for r, i, d in zip(ref_idx, img_idx, dist)
+			]
+		return self._matches
+
+
+	@matches.setter
+	def matches(self, matches: List[Tuple['cv.DMatch']]) -> NoReturn:
+		k = len(matches[0]) if len(matches) else 2
+		flat = list(chain.from_iterable(matches))
+
+		# One pass per field, without building a tuple per match
+		self.knn = tuple(
+			np.fromiter(map(attrgetter(field), flat), dtype, len(flat)).reshape(-1, k)
+			for field, dtype in (('queryIdx', 'int32'), ('trainIdx', 'int32'), ('distance', 'float32'))
+		)
+		self._matches = matches
+
+
+	@property
+	def good_matches(self) -> List['cv.DMatch']:
+		"""
+		The close matches kept by filter_matches(). Built from self.good 
+		when first accessed.
+		"""
+		if self._good_matches is None:
+			ref_idx, img_idx, dist = (a.tolist() for a in self.good)
+			self._good_matches = [ cv.DMatch(*m) for m in zip(ref_idx, img_idx, dist) ]
+		return self._good_matches
+
+
+	@good_matches.setter
+	def good_matches(self, matches: List['cv.DMatch']) -> NoReturn:
+		self.good = tuple(
+			np.fromiter(map(attrgetter(field), matches), dtype, len(matches))
+			for field, dtype in (('queryIdx', 'int32'), ('trainIdx', 'int32'), ('distance', 'float32'))
+		)
+		self._good_matches = matches
 
 
 	def filter_matches(self, ratio: float=None) -> NoReturn: 
 		"""
-		Keep only the close matches
+		Keep only the close matches, by the ratio test on the distances of
+		each descriptor's 2 nearest neighbors. Applied to all the matches at
+		once with array operations.
 
 		Parameters
 		----------
 		ratio : float
 			The upper limit of ref_match_distance/img__match_distance
 		"""
-		good = []
 		if ratio == None:
 			ratio = self.MATCH_RATIO
-			
-		for r,i in self.matches:
-			if r.distance < ratio * i.distance:
-				good.append(r)
 
-		self.good_matches = good
+		ref_idx, img_idx, dist = self.knn
+		close = dist[:, 0] < ratio * dist[:, 1]
+
+		self.good = (ref_idx[close, 0], img_idx[close, 0], dist[close, 0])
+		self._good_matches = None
 
 
 	def get_homography(self) -> NoReturn:
@@ -184,22 +638,189 @@ class Dewarper():
 		and the homography mask, then stores them in 
 		self.transformation_matrix
 		self.homo_mask
+
+		If the Dewarper has a seed transform that maps at least 
+		SEED_INLIER_RATIO of the close matches to within 5 px of their 
+		reference keypoints, M is fit to those inliers by least squares 
+		instead of by RANSAC.
 		"""
-		if len(self.good_matches) < self.MIN_MATCH_COUNT:
-			print(f"To find the homography, at least {MIN_MATCH_COUNT} closely matching keypoints are necessary. These images have only {len(self.good_matches)} keypoints.")
+		self.transformation_matrix = None
+		self.homo_mask = None
+		self.quality = None
+
+		if len(self.good[0]) < self.MIN_MATCH_COUNT:
+			print(f"To find the homography, at least {self.MIN_MATCH_COUNT} closely matching keypoints are necessary. These images have only {len(self.good[0])}.")
 			return
 		else:
-			kp_ref = self.kpd_ref.kp
-			kp_img = self.kpd_img.kp
+			ref_pts, img_pts = self.matched_points()
+
+			M = None
+
+			if self.seed is not None:
+				projected = cv.perspectiveTransform(img_pts, self.seed)
+				inliers = np.linalg.norm(projected - ref_pts, axis=2).ravel() < 5.0
+
+				if inliers.mean() >= self.SEED_INLIER_RATIO and inliers.sum() >= self.MIN_MATCH_COUNT:
+					M, _ = cv.findHomography(img_pts[inliers], ref_pts[inliers], 0)
+					mask = inliers.astype('uint8')
+					self.homography_source = 'seed_refined'
+
+			if M is None:
+				M, mask = cv.findHomography(img_pts, ref_pts, cv.RANSAC, 5.0)
+				self.homography_source = 'ransac'
 
-			ref_pts = np.float32( [ kp_ref[m.queryIdx].pt for m in self.good_matches ] ).reshape(-1,1,2)
-			img_pts = np.float32( [ kp_img[m.trainIdx].pt for m in self.good_matches ] ).reshape(-1,1,2)
+			if M is None:
+				print("The homography could not be found, the matching keypoints are degenerate.")
+				return
 
-			M, mask = cv.findHomography(img_pts, ref_pts, cv.RANSAC, 5.0)
 			mask = mask.ravel().tolist()
 
 			self.transformation_matrix = M
 			self.homo_mask = mask
+			self.quality = self.measure_homography()
+
+
+	def matched_points(self) -> Tuple['np.ndarray[float]', 'np.ndarray[float]']:
+		"""
+		Returns the (N, 1, 2) arrays of the reference & image keypoint 
+		coordinates of the N close matches.
+		"""
+		ref_idx, img_idx, _ = self.good
+
+		ref_pts = cv.KeyPoint_convert(self.kpd_ref.kp)[ref_idx].reshape(-1,1,2)
+		img_pts = cv.KeyPoint_convert(self.kpd_img.kp)[img_idx].reshape(-1,1,2)
+
+		return ref_pts, img_pts
+
+
+	def measure_homography(self) -> 'Dewarper.Quality':
+		"""
+		Measures the quality of self.transformation_matrix over the close 
+		matches. See Dewarper.Quality.
+
+		Returns
+		-------
+		Dewarper.Quality
+			The quality metrics, or None if there's no transformation matrix
+		"""
+		M = self.transformation_matrix
+		if M is None:
+			return None
+
+		ref_pts, img_pts = self.matched_points()
+		error = np.linalg.norm(cv.perspectiveTransform(img_pts, M) - ref_pts, axis=2).ravel()
+		inliers = error < 5.0
+		A = M[0:2, 0:2] / M[2,2]
+
+		quality = self.Quality(
+			matches=len(error),
+			inliers=int(inliers.sum()),
+			inlier_ratio=float(inliers.mean()) if len(error) else 0.0,
+			reprojection_error=float(np.sqrt(np.mean(error[inliers]**2))) if inliers.any() else np.inf,
+			determinant=float(np.linalg.det(A)),
+			condition=float(np.linalg.cond(A))
+		)
+
+		return quality
+
+
+	def is_acceptable(self, quality: 'Dewarper.Quality'=None) -> bool:
+		"""
+		Whether a homography's quality is within the limits of an acceptable
+		homography: MIN_INLIERS, MIN_INLIER_RATIO, MAX_REPROJECTION_ERROR, 
+		DETERMINANT_RANGE, and MAX_CONDITION. A homography matched to too 
+		few keypoints typically distorts the page's area & aspect ratio. One
+		matched to the wrong page may not, e.g. when the pages share their
+		layout, but only the shared content is consistent with it, so few 
+		of its close matches are inliers.
+
+		Parameters
+		----------
+		quality : Dewarper.Quality
+			The quality to check, self.quality if None
+		"""
+		q = self.quality if quality is None else quality
+		if q is None:
+			return False
+
+		low, high = self.DETERMINANT_RANGE
+
+		return (q.inliers >= self.MIN_INLIERS 
+				and q.inlier_ratio >= self.MIN_INLIER_RATIO
+				and q.reprojection_error <= self.MAX_REPROJECTION_ERROR
+				and low <= q.determinant <= high 
+				and q.condition <= self.MAX_CONDITION)
+
+
+	def fall_back(self) -> NoReturn:
+		"""
+		Tries each of self.fallbacks in order until one yields an acceptable
+		homography, then adopts its matches & transformation matrix and 
+		stores the fallback's name in self.homography_source. The current
+		homography is kept if none does.
+
+		'ratio' refilters the matches with RELAXED_MATCH_RATIO; a detector
+		backend, e.g. 'orb', matches the images again with that detector; 
+		'identity' always succeeds and leaves the image as is, so a bad page
+		degrades instead of stopping the pipeline.
+		"""
+		adopted = ('kpd_ref', 'kpd_img', 'knn', '_matches', 'good', '_good_matches',
+				   'transformation_matrix', 'homo_mask', 'quality')
+
+		for fallback in self.fallbacks:
+			if fallback == 'identity':
+				self.transformation_matrix = np.eye(3)
+				self.homo_mask = None
+				self.quality = None
+				self.homography_source = fallback
+				return
+
+			if fallback == 'ratio':
+				alt = copy.copy(self)
+				alt.filter_matches(self.RELAXED_MATCH_RATIO)
+			else:
+				alt = Dewarper(self.ref, self.img, cache=self.cache, grayscale=True, 
+							   ref_mask=self.ref_mask, max_keypoints=self.max_keypoints,
+							   detector=fallback)
+				alt.img_mask = self.img_mask
+				alt.sift('ref')
+				alt.sift('img')
+				alt.fann()
+				alt.filter_matches()
+
+			alt.get_homography()
+
+			if self.is_acceptable(alt.quality):
+				for name in adopted:
+					setattr(self, name, getattr(alt, name))
+				self.homography_source = fallback
+				return
+
+
+	def refine_homography(self) -> NoReturn:
+		"""
+		Refines self.transformation_matrix by ECC image alignment of the 
+		full resolution images. Used in pyramid mode, where the matrix is 
+		estimated from keypoints on downscaled images and is only accurate
+		to a fraction of a pixel at that scale. ECC starts from the coarse
+		estimate, so it converges in a few iterations on mildly skewed 
+		pages. The coarse estimate is kept if ECC fails to converge.
+		"""
+		M = self.transformation_matrix
+		if M is None:
+			return
+
+		# ECC warps the reference frame onto the image, the inverse of M
+		W = np.linalg.inv(M)
+		W = (W / W[2,2]).astype('float32')
+
+		try:
+			_, W = cv.findTransformECC(self.ref, self.img, W, cv.MOTION_HOMOGRAPHY, 
+									   self.ecc_criteria, None, 5)
+		except cv.error:
+			return
+
+		self.transformation_matrix = np.linalg.inv(W.astype('float64'))
 
 
 	def apply_transform(self) -> NoReturn:
@@ -237,12 +858,19 @@ class Dewarper():
 		plt.imshow(comparison, 'gray'), plt.show()
 
 
-	def dewarp_image(self) -> NoReturn:
+	def dewarp_image(self, dst: CV_Image=None) -> NoReturn:
 		"""
 		Dewarp the skewed image by applying the img --> ref transformation
 		matrix. Implicitly converts color images to grayscale. Stores the 
 		dewarped image in self.dewarped.
 
+		Parameters
+		----------
+		dst : ndarray
+			Optional preallocated output with the reference's height & width
+			and the skewed image's channels, e.g. a view into a memory-mapped
+			page stack. The dewarped image is written into it in place.
+
 		Returns
 		-------
 		ndarray
@@ -250,7 +878,10 @@ class Dewarper():
 		"""
 		h, w = self.ref.shape
 		M = self.transformation_matrix
-		dewarped = cv.warpPerspective(self.og, M, (w,h))
+		if M is None:
+			raise ValueError("The homography is missing, the images couldn't be matched.")
+
+		dewarped = cv.warpPerspective(self.og, M, (w,h), dst=dst)
 
 		self.dewarped = dewarped
 
@@ -262,13 +893,55 @@ class Dewarper():
 		return dewarped
 			
 
+	def dewarp_regions(self, boxes: List['Box']) -> List[CV_Image]:
+		"""
+		Dewarps only the given rectangular regions of the reference frame,
+		instead of the whole image. Each region is warped directly by 
+		composing the img --> ref transformation matrix with a translation 
+		of the region's top left corner to the origin, so pixels outside 
+		the regions are never transformed. Stores the regions in 
+		self.dewarped_regions.
+
+		Parameters
+		----------
+		boxes : list[Box]
+			The regions of the reference image to dewarp. Anything with x, y,
+			w, h attributes, e.g. the 'tables' of a ScoreKey.
+
+		Returns
+		-------
+		list[ndarray]
+			The dewarped regions, region i has the size of boxes[i]. Each is
+			identical to the same region cropped from dewarp_image().
+		"""
+		M = self.transformation_matrix
+		if M is None:
+			raise ValueError("The homography is missing, the images couldn't be matched.")
+
+		regions = []
+
+		for box in boxes:
+			T = np.array([ [1, 0, -box.x], [0, 1, -box.y], [0, 0, 1] ], dtype='float64')
+			region = cv.warpPerspective(self.og, T @ M, (box.w, box.h))
+			regions.append(region)
+
+		self.dewarped_regions = regions
+
+		return regions
+
+
 	def dewarp(self, 
 			   ref: Union[str, 'np.ndarray[int]']=None, 
-			   img: Union[str, 'np.ndarray[int]']=None
-	) -> CV_Image:
+			   img: Union[str, 'np.ndarray[int]']=None,
+			   dst: CV_Image=None,
+			   regions: List['Box']=None
+	) -> Union[CV_Image, List[CV_Image]]:
 		"""
 		Wrapper method: performs full dewarping pipeline. Passing arguments
-		overwrites any images currently stored in the dewarper.
+		overwrites any images currently stored in the dewarper. The 
+		reference features are reused if they were already computed for 
+		the current reference image, and so are the image features, e.g.
+		those set by DewarpSession.get_dewarper().
 
 		Parameters
 		----------
@@ -280,28 +953,37 @@ class Dewarper():
 			str - path to an image file
 			ndarray - the skewed image 
 
+		dst : ndarray
+			Optional preallocated output for the dewarped image, see 
+			dewarp_image()
+
+		regions : list[Box]
+			If given, only these regions of the reference frame are dewarped,
+			see dewarp_regions(). Their borders also validate the seed, if
+			any; otherwise the borders of the page do.
+
 
 		Returns
 		-------
-		ndarray
-			The dewarped image
+		ndarray or list[ndarray]
+			The dewarped image, or the dewarped regions if regions are given
 		"""
 
 		# Handle strings or images as constructor args
 		if isinstance(ref, str):
 			self.load(ref, 'ref')
-		elif isinstance(ref, np.ndarray):
+		elif isinstance(ref, np.ndarray) and len(ref.shape) == 3:
 			self.ref = cv.cvtColor(ref, cv.COLOR_BGR2GRAY)
+		elif isinstance(ref, np.ndarray):
+			self.ref = ref
 		else:
 			pass
 
-		if isinstance(img, str):
-			self.load(img, 'img') 
-		elif isinstance(img, np.ndarray):
-			self.og = img
-			self.img = cv.cvtColor(self.og, cv.COLOR_BGR2GRAY)
-		else:
-			pass
+		if ref is not None:
+			self.kpd_ref = self.Kpd(None, None)
+
+		if img is not None:
+			self.set_image(img)
 
 
 		if self.ref is None:
@@ -309,12 +991,28 @@ class Dewarper():
 		if self.img is None:
 			raise ValueError("The warped image is missing. Pass the file path explicitly.")
 
-		self.sift('ref')
-		self.sift('img')
-		self.fann()
-		self.filter_matches()
-		self.get_homography()
-		dewarped = self.dewarp_image()
+		if self.seed is not None and self.is_aligned(regions, M=self.seed):
+			self.transformation_matrix = self.seed
+			self.homography_source = 'seed'
+		else:
+			if self.kpd_ref.kp is None:
+				self.sift('ref')
+			if self.kpd_img.kp is None:
+				self.sift('img')
+			self.fann()
+			self.filter_matches()
+			self.get_homography()
+			if self.pyramid_scale:
+				self.refine_homography()
+				self.quality = self.measure_homography()
+
+			if not self.is_acceptable():
+				self.fall_back()
+
+		if regions is not None:
+			return self.dewarp_regions(regions)
+
+		dewarped = self.dewarp_image(dst)
 
 		return dewarped
 
@@ -0,0 +1,253 @@
+# featureCache.py
+# Memory and disk storage for precomputed reference keypoint descriptors
+
+import os
+import hashlib
+import cv2 as cv
+import numpy as np
+from typing import Union, List, Tuple, Dict, NoReturn, Any
+
+FLANN_INDEX_LSH = 6
+
+
+class FeatureCache():
+	"""
+	Stores the keypoints and descriptors of reference images so they are
+	computed once and reused by every Dewarper that matches against the same
+	reference. Entries are keyed by a hash of the reference image and the
+	detector parameters. Entries are always held in memory; if a directory is
+	given they are also written to, and read from, .npz files on disk so they
+	persist across runs. FLANN indexes built over the reference descriptors
+	are stored the same way, alongside the descriptors they index.
+
+	Attributes
+	----------
+	directory : str
+		path/to/the/cache/directory, or None for a memory-only cache
+
+	features : dict
+		Key : str
+			A hash of the reference image & detector parameters
+		Val : tuple(tuple[cv.KeyPoint], ndarray)
+			The keypoints and descriptors of the reference image
+
+	indexes : dict
+		Key : str
+			A hash of the feature key & index parameters
+		Val : cv.flann_Index
+			A trained FLANN index over the reference descriptors
+	"""
+
+	def __init__(self, directory: str=None) -> NoReturn:
+		"""
+		The constructor
+
+		Parameters
+		----------
+		directory : str
+			path/to/the/cache/directory. Created if it doesn't exist. If None,
+			features are only cached in memory.
+		"""
+		self.directory = directory
+		self.features = {}
+		self.indexes = {}
+
+		if directory is not None:
+			os.makedirs(directory, exist_ok=True)
+
+
+	def key(self, 
+			image: 'np.ndarray[int]', 
+			params: Dict[str, Any], 
+			mask: 'np.ndarray[int]'=None
+	) -> str:
+		"""
+		Hashes an image, the parameters of the detector run on it, and the 
+		detection mask, if any.
+
+		Parameters
+		----------
+		image : ndarray
+			The reference image
+
+		params : dict
+			The detector parameters, e.g. {'nfeatures': 0, 'sigma': 1.6}
+
+		mask : ndarray
+			The detection mask, or None if the whole image is searched
+
+		Returns
+		-------
+		str
+			A hex digest identifying the image/parameter combination
+		"""
+		image = np.ascontiguousarray(image)
+
+		h = hashlib.sha1()
+		h.update(str(image.shape).encode())
+		h.update(str(image.dtype).encode())
+		h.update(image.data)
+		h.update(repr(sorted(params.items())).encode())
+		h.update(cv.__version__.encode())
+
+		if mask is not None:
+			h.update(np.ascontiguousarray(mask).data)
+
+		return h.hexdigest()
+
+
+	def path(self, key: str, extension: str='npz') -> str:
+		"""
+		Returns path/to/the/cache/entry.extension for a key, or None for a
+		memory-only cache.
+		"""
+		if self.directory is None:
+			return None
+		return os.path.join(self.directory, f"{key}.{extension}")
+
+
+	def get(self, key: str) -> Tuple[Tuple['cv.KeyPoint'], 'np.ndarray']:
+		"""
+		Retrieves the keypoints and descriptors stored under a key, checking
+		memory first and then disk.
+
+		Parameters
+		----------
+		key : str
+			A key returned by self.key()
+
+		Returns
+		-------
+		tuple(tuple[cv.KeyPoint], ndarray)
+			The keypoints and descriptors, or None if the key isn't cached
+		"""
+		if key in self.features:
+			return self.features[key]
+
+		path = self.path(key)
+		if path is None or not os.path.isfile(path):
+			return None
+
+		with np.load(path) as npz:
+			kp = self.array_to_keypoints(npz['kp'])
+			des = npz['des']
+
+		self.features[key] = (kp, des)
+
+		return kp, des
+
+
+	def put(self,
+			key: str,
+			kp: List['cv.KeyPoint'],
+			des: 'np.ndarray'
+	) -> NoReturn:
+		"""
+		Stores keypoints and descriptors in memory and, if the cache has a
+		directory, on disk.
+
+		Parameters
+		----------
+		key : str
+			A key returned by self.key()
+
+		kp : list[cv.KeyPoint]
+			The keypoints of the reference image
+
+		des : ndarray
+			The descriptors of the reference image, 1 row per keypoint
+		"""
+		kp = tuple(kp)
+		self.features[key] = (kp, des)
+
+		path = self.path(key)
+		if path is not None:
+			# Write to a temp file & rename, so concurrent runs never read a
+			# partially written entry
+			tmp = f"{path}.{os.getpid()}.tmp.npz"
+			np.savez(tmp, kp=self.keypoints_to_array(kp), des=des)
+			os.replace(tmp, path)
+
+
+	def keypoints_to_array(self, kp: List['cv.KeyPoint']) -> 'np.ndarray':
+		"""
+		Converts keypoints to an (N, 7) float array for serialization. The
+		columns are: x, y, size, angle, response, octave, class_id
+		"""
+		array = np.array(
+			[ (*k.pt, k.size, k.angle, k.response, k.octave, k.class_id) for k in kp ],
+			dtype='float64'
+		)
+		return array.reshape(-1, 7)
+
+
+	def array_to_keypoints(self, array: 'np.ndarray') -> Tuple['cv.KeyPoint']:
+		"""
+		Converts an (N, 7) array from self.keypoints_to_array() back into
+		keypoints.
+		"""
+		kp = tuple(
+			cv.KeyPoint(x, y, size, angle, response, int(octave), int(class_id))
+			for x, y, size, angle, response, octave, class_id in array
+		)
+		return kp
+
+
+	def get_index(self,
+				  key: str,
+				  des: 'np.ndarray',
+				  index_params: Dict[str, Any]
+	) -> 'cv.flann_Index':
+		"""
+		Retrieves the FLANN index over a reference's descriptors, loading it
+		from disk or building it if necessary. The index is trained once and
+		shared by every caller matching against the same reference. LSH 
+		indexes are only cached in memory.
+
+		Parameters
+		----------
+		key : str
+			The key under which the reference features are cached
+
+		des : ndarray
+			The reference descriptors, 1 row per keypoint. A FLANN index 
+			doesn't store the data it indexes, so these are needed to load
+			or build it.
+
+		index_params : dict
+			The FLANN index parameters, e.g. {'algorithm': 1, 'trees': 5}
+
+		Returns
+		-------
+		cv.flann_Index
+			A trained index; query it with knnSearch()
+		"""
+		h = hashlib.sha1(key.encode())
+		h.update(repr(sorted(index_params.items())).encode())
+		index_key = h.hexdigest()
+
+		if index_key in self.indexes:
+			return self.indexes[index_key]
+
+		path = self.path(index_key, 'flann')
+		index = None
+
+		# OpenCV crashes loading saved LSH indexes, so those stay in memory
+		if index_params.get('algorithm') == FLANN_INDEX_LSH:
+			path = None
+
+		if path is not None and os.path.isfile(path):
+			index = cv.flann_Index()
+			if not index.load(des, path):
+				index = None
+
+		if index is None:
+			index = cv.flann_Index(des, index_params)
+			if path is not None:
+				tmp = f"{path}.{os.getpid()}.tmp"
+				index.save(tmp)
+				os.replace(tmp, path)
+
+		self.indexes[index_key] = index
+
+		return index
@@ -66,7 +66,8 @@ class Marker(Box):
     Attributes
     ----------
     contour : CV_Contour
-        The marker's contour (numpy array[uint8]).
+        The marker's contour (numpy array[uint8]), or None if the marker
+        was extracted as a connected component.
 
     box : Box
         The contour's bounding box info (x, y, w, h) along with
@@ -78,12 +79,19 @@ class Marker(Box):
     row : int
         The 1-indexed row number at which the marker resides.
     """
-    def __init__(self, contour: CV_Contour) -> None:
+    def __init__(self, contour: CV_Contour, box: Union[Box, Tuple[int]]=None) -> None:
         """
-        Stores contour and bounding box information for 
+        Stores contour and bounding box information for a marker. The 
+        bounding box is computed from the contour unless it's given, e.g.
+        as a row of ScoreKey.extract_marker_boxes().
         """
-        x, y, w, h = cv2.boundingRect(contour)
-        self.box = Box(x, y, w, h)
+        if box is None:
+            box = cv2.boundingRect(contour)
+        if not isinstance(box, Box):
+            x, y, w, h = (int(v) for v in box)
+            box = Box(x, y, w, h)
+
+        self.box = box
         self.contour = contour
         self.column = None
         self.row = None
@@ -151,10 +159,46 @@ class ScoreKey(Box):
 
     images : list[CV_Image]
         The images of the Scoring Key boxes.
+
+    grayscale : bool
+        Whether the Scoring Key box images of a grayscale page are kept as 
+        single channel views into the page, instead of being converted 
+        to BGR.
+
+    cells : list[np.ndarray[int]]
+        The cells of each Scoring Key box, precomputed from the known 
+        table geometry: an (R, C, 4) array of the (x, y, w, h) band sampled
+        for the mark of each question row & category column, see 
+        get_cells().
     """
+
+    Grid = namedtuple('Grid', ['rows', 'columns', 'row_lookup', 'column_lookup'])
+    """
+    The rows & columns of a Scoring Key box image, see detect_grid(). 
+    'rows' is an (R, 2) array of the [y0, y1) span of each question row, 
+    centered on the row's baseline, where its category marks are drawn. 
+    'columns' is a (C, 2) array of the [x0, x1) interior of each column, 
+    the 'Key' column first. 'row_lookup' maps each y of the image to its 
+    question number, 0 outside the rows, and 'column_lookup' maps each x 
+    to its column index, -1 on the ruling lines.
+    """
+
+    LINE_FRACTION = 0.8  # The min fraction of inked pixels of a ruling line
+    TEXT_MAX = 200  # The max value of the 'Key' text; dewarping blurs fainter ink between rows
+
+    ROW_STRIDE = 16.66  # The vertical stride of the question rows
+    MARKER_OFFSET = 6  # The offset of the category marks below the row ordinals
+    ROW_HEIGHT = 16  # The height of a row's category mark selection area
+    CELL_HEIGHT = 8  # The height of the band sampled in the middle of a selection area
+    CELL_MARGIN = 3  # The margin kept clear of the ruling lines
+    RULE_WIDTH = 2  # The width of the ruling lines of a box
+    MIN_CELL_INK = 15  # The min inked pixels of a marked cell, the min width of a marker line
+    MARKER_WIDTH = 20  # The typical width of a marker line
+    MARKER_HEIGHT = 3  # The max height of a marker line, once closed
+    UNCERTAIN_SCORES = (0.25, 0.75)  # The range of cell scores flagged as low confidence
     
 
-    def __init__(self, section_code: str, page: CV_Image=None) -> None:
+    def __init__(self, section_code: str, page: CV_Image=None, grayscale: bool=False) -> None:
         """
         The constructor
 
@@ -166,6 +210,9 @@ class ScoreKey(Box):
         page : numpy.ndarray
             An image of the page containing the scoring key boxes
 
+        grayscale : bool
+            If True, keep the box images of a grayscale page as grayscale
+
         Returns
         -------
         None
@@ -181,6 +228,21 @@ class ScoreKey(Box):
             's2' : Box(277, 594, 163, 407),
         }
 
+        # The (x, w) of each category column, see box_positions.py
+        expected_column_parameters = {
+            'e1' : [(60, 34), (94, 34), (129, 33)],
+            'e2' : [(60, 34), (94, 34), (128, 34)],
+            'm1' : [(60, 35), (94, 35), (128, 35), (162, 35), (196, 35), (231, 33), (265, 33)],
+            'm2' : [(61, 35), (95, 35), (129, 35), (163, 35), (197, 35), (231, 34), (265, 34)],
+            'r1' : [(60, 34), (95, 33), (129, 33)],
+            'r2' : [(60, 34), (94, 34), (128, 34)],
+            's1' : [(60, 34), (95, 33), (129, 33)],
+            's2' : [(60, 34), (94, 34), (128, 34)],
+        }
+
+        # The y of the first row ordinal, see README §4
+        expected_row_parameters = {'e': 70, 'm': 81, 'r': 70, 's': 70}
+
         score_key_metadata = {
             'e': {'num_questions': 75},
             'm': {'num_questions': 60},
@@ -212,10 +274,21 @@ class ScoreKey(Box):
 
         self.tables = [None, None]
         self.images = [None, None]
+        self.grayscale = grayscale
 
         self.tables[0] = expected_table_parameters[f'{section_code}1']
         self.tables[1] = expected_table_parameters[f'{section_code}2']
 
+        rows = int(0.5 * self.num_questions + 0.5)
+        self.cells = [
+            self.get_cells(expected_column_parameters[f'{section_code}1'], 
+                           expected_row_parameters[section_code], rows,
+                           self.tables[0].h - self.RULE_WIDTH),
+            self.get_cells(expected_column_parameters[f'{section_code}2'], 
+                           expected_row_parameters[section_code], self.num_questions - rows,
+                           self.tables[1].h - self.RULE_WIDTH),
+        ]
+
 
         if page is None:
             pass
@@ -229,6 +302,8 @@ class ScoreKey(Box):
         """
         Subsets a pair of Scoring Key boxes from an 850 x 1100 px page image 
         and stores them as CV_Images (np.ndarray) in the 'images' attribute."
+        The boxes of a grayscale page are converted to BGR, unless the 
+        ScoreKey is in grayscale mode.
 
         Parameters
         ----------
@@ -246,17 +321,54 @@ class ScoreKey(Box):
         w, h = page.shape[1], page.shape[0]
         if w != 850 or h != 1100:
                 raise TypeError(f"The page must be 850 x 1100 pixels, not {w} x {h}.")
-        if len(page.shape) < 3:
-            page = cv2.cvtColor(page, cv2.COLOR_GRAY2BGR)
         
+        # Crop before converting, so the page itself is never copied. The 
+        # boxes of a BGR page, or a grayscale page in grayscale mode, are 
+        # views into it.
         for i, params in enumerate(self.tables):
             x, y, w, h = params.x, params.y, params.w, params.h
             box = page[y:y+h, x:x+w]
+            if len(box.shape) < 3 and not self.grayscale:
+                box = cv2.cvtColor(box, cv2.COLOR_GRAY2BGR)
             self.images[i] = box
 
         return True
     
 
+    def load_images(self, images: List[CV_Image]) -> bool:
+        """
+        Stores a pair of Scoring Key box images that were already cut from 
+        a page, e.g. by dewarping only the regions in 'tables', in the 
+        'images' attribute. 
+
+        Parameters
+        ----------
+        images : list[CV_Image]
+            The 2 box images, each the size of the corresponding Box in 
+            'tables'.
+
+        Returns
+        -------
+        bool
+            True if the method doensn't crash, False otherwise
+        """
+        if len(images) != len(self.tables):
+            raise ValueError(f"Expected {len(self.tables)} box images, not {len(images)}.")
+
+        for i, (box, params) in enumerate(zip(images, self.tables)):
+            if not isinstance(box, np.ndarray):
+                raise TypeError(f"The box images must be numpy arrays of integers, not a {type(box)}.")
+
+            w, h = box.shape[1], box.shape[0]
+            if w != params.w or h != params.h:
+                raise TypeError(f"Box image {i} must be {params.w} x {params.h} pixels, not {w} x {h}.")
+            if len(box.shape) < 3 and not self.grayscale:
+                box = cv2.cvtColor(box, cv2.COLOR_GRAY2BGR)
+            self.images[i] = box
+
+        return True
+
+
     def get_contours(self, image: CV_Image, 
                             min: int=250, 
                             max: int=255,
@@ -316,11 +428,473 @@ class ScoreKey(Box):
         return contours
 
 
+    def get_components(self, image: CV_Image, 
+                              min: int=250, 
+                              max: int=255,
+                              kernel: Tuple[int]=(5,1)
+    ) -> 'np.ndarray[int]':
+        """
+        Extracts from an image the bounding boxes of all connected 
+        components, after the same Morphological Closing and Binary 
+        Threshold operations as self.get_contours(). The boxes are returned
+        directly as a single array; no contour polygons are built.
+
+        Parameters
+        ----------
+        image : CV_Image
+            A numpy ndarray representing an image
+
+        min : int
+            The threshold to use for the Binary Threshold operation
+
+        max : int
+            The max pixel intensity to use for the Binary Threshold operation
+
+        kernel : Tuple[int, int]
+            A solid rectangle of (width, height) that is convolved with the 
+            image during the Morphological Closing operation, see 
+            self.get_contours()
+
+        Returns
+        -------
+        np.ndarray[int]
+            An (N, 5) array, 1 row of (x, y, w, h, area) per component, 
+            where area is the component's number of pixels. The first 4 
+            columns are the same as the bounding rects of the component's 
+            outer contour.
+        """
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        cv_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, kernel)
+        closed = cv2.morphologyEx(image, cv2.MORPH_CLOSE, cv_kernel)
+        closed_inv = cv2.threshold(closed, min, max, cv2.THRESH_BINARY_INV)[1]
+        # Grana's block based labeling is the fastest on the sparse images of
+        # the Scoring Key boxes
+        stats = cv2.connectedComponentsWithStatsWithAlgorithm(
+            closed_inv, 8, cv2.CV_32S, cv2.CCL_GRANA
+        )[2]
+
+        return stats[1:]  # Omit the background
+
+
+    def detect_grid(self, 
+                    image: CV_Image, 
+                    first_row: int=1, 
+                    min: int=250
+    ) -> 'ScoreKey.Grid':
+        """
+        Locates the rows & columns of a Scoring Key box image from the ink
+        projection profiles of the thresholded image, without extracting 
+        any contours:
+
+        (1) The rows of full width ink are the horizontal ruling lines; the
+            body of the box is the largest gap between them
+        (2) The columns of the body at least LINE_FRACTION inked are the 
+            vertical ruling lines, which bound the columns
+        (3) The bands of ink in the body of the 'Key' column, thresholded
+            at TEXT_MAX, are the question rows. A regular stride is fitted
+            to the tops of the bands, so bands merged or broken by 
+            dewarping don't add or drop rows; the baselines are a text 
+            height below, and the rows are split halfway between 
+            consecutive baselines
+
+        Parameters
+        ----------
+        image : CV_Image
+            A Scoring Key box image
+
+        first_row : int
+            The question number of the first row of the image, e.g. 39 for
+            the 2nd English box
+
+        min : int
+            The threshold separating the ink from the paper
+
+        Returns
+        -------
+        ScoreKey.Grid
+            The rows, columns, and their lookup arrays
+        """
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        ink = image < min
+        h, w = ink.shape
+
+        def runs(mask: 'np.ndarray[bool]') -> 'np.ndarray[int]':
+            # The [start, stop) of each run of True values, as a (N, 2) array
+            edges = np.diff(np.concatenate(([0], mask.view('int8'), [0])))
+            return np.stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)), axis=1)
+
+        ### (1) The body between the horizontal ruling lines
+        lines = runs(ink.mean(axis=1) >= 0.9)
+        bounds = np.concatenate(([0], lines.ravel(), [h])).reshape(-1, 2)
+        y0, y1 = bounds[np.argmax(bounds[:, 1] - bounds[:, 0])]
+        body = ink[y0:y1]
+
+        ### (2) The columns between the vertical ruling lines
+        lines = runs(body.mean(axis=0) >= self.LINE_FRACTION)
+        columns = np.stack((lines[:-1, 1], lines[1:, 0]), axis=1)
+
+        if len(columns) != len(self.column_names):
+            raise ValueError(f"Found {len(columns)} columns in the '{self.section_code}' box, expected {len(self.column_names)}.")
+
+        ### (3) The rows from the baselines of the 'Key' column
+        x0, x1 = columns[0]
+        text = image[y0:y1, x0:x1] < self.TEXT_MAX
+        bands = runs(text.any(axis=1))
+        heights = bands[:, 1] - bands[:, 0]
+        size = np.median(heights)
+        size = np.median(heights[np.abs(heights - size) <= 0.3 * size])  # The text height
+        tops = y0 + bands[heights >= 0.7 * size, 0]  # Omit specks & broken bands
+
+        if len(tops) < 2:
+            raise ValueError(f"Found {len(tops)} question rows in the '{self.section_code}' box.")
+
+        # Number the tops by the steps between them, in strides of the mean
+        # step between adjacent rows, then fit the stride to the tops on it
+        steps = np.diff(tops)
+        adjacent = np.abs(steps - np.median(steps)) <= 0.25 * np.median(steps)
+        k = np.concatenate(([0], np.cumsum(np.round(steps / steps[adjacent].mean()))))
+        stride, offset = np.polyfit(k, tops, 1)
+        inliers = np.abs(tops - (offset + stride * k)) <= 0.25 * stride
+        stride, offset = np.polyfit(k[inliers], tops[inliers], 1)
+        offset += size
+        k = np.arange(np.ceil((y0 - offset) / stride), np.floor((y1 - offset) / stride) + 1)
+        baselines = np.round(offset + stride * k).astype('int64')
+
+        splits = (baselines[:-1] + baselines[1:] + 1) // 2
+        rows = np.stack((np.concatenate(([y0], splits)), np.concatenate((splits, [y1]))), axis=1)
+
+        ### Lookup arrays
+        row_lookup = np.zeros(h, dtype='int32')
+        for j, (r0, r1) in enumerate(rows):
+            row_lookup[r0:r1] = first_row + j
+
+        column_lookup = np.full(w, -1, dtype='int32')
+        for j, (c0, c1) in enumerate(columns):
+            column_lookup[c0:c1] = j
+
+        return self.Grid(rows, columns, row_lookup, column_lookup)
+
+
+    def locate_markers(self, 
+                       grid: 'ScoreKey.Grid', 
+                       rects: 'np.ndarray[int]'
+    ) -> Tuple['np.ndarray[int]']:
+        """
+        Finds the question row & column of each marker line, by looking up
+        the center of its bounding rect in the grid's lookup arrays.
+
+        Parameters
+        ----------
+        grid : ScoreKey.Grid
+            The grid of the image the markers were found in
+
+        rects : np.ndarray[int]
+            1 row of (x, y, w, h) per marker line
+
+        Returns
+        -------
+        tuple(np.ndarray[int], np.ndarray[int])
+            The question number of each marker, 0 outside the rows, and 
+            its column index in self.column_names, -1 on a ruling line
+        """
+        x, y, w, h = rects.reshape(-1, 4).T
+        rows = grid.row_lookup[np.clip(y + h//2, 0, len(grid.row_lookup) - 1)]
+        columns = grid.column_lookup[np.clip(x + w//2, 0, len(grid.column_lookup) - 1)]
+
+        return rows, columns
+
+
+    def get_cells(self, 
+                  columns: List[Tuple[int]], 
+                  y0: int, 
+                  num_rows: int,
+                  bottom: int
+    ) -> 'np.ndarray[int]':
+        """
+        Lays out the cells of a Scoring Key box from the table geometry. 
+        The rows repeat every ROW_STRIDE px from the first row ordinal at 
+        y0, and the category marks of each row lie in a ROW_HEIGHT 
+        selection area MARKER_OFFSET px below its ordinal. Each cell is the
+        CELL_HEIGHT band in the middle of a selection area, across a 
+        column's interior. The bands are kept CELL_MARGIN px clear of the
+        box's bottom ruling line, whose edge any dewarping spreads into 
+        the last row.
+
+        Parameters
+        ----------
+        columns : list[tuple(int, int)]
+            The (x, w) of each category column
+
+        y0 : int
+            The y of the first row ordinal
+
+        num_rows : int
+            The number of question rows in the box
+
+        bottom : int
+            The y of the box's bottom ruling line
+
+        Returns
+        -------
+        np.ndarray[int]
+            An (R, C, 4) array, the (x, y, w, h) of each cell
+        """
+        x, w = np.array(columns).T
+        y = y0 + self.MARKER_OFFSET + (self.ROW_HEIGHT - self.CELL_HEIGHT) // 2
+        y = np.round(y + self.ROW_STRIDE * np.arange(num_rows)).astype('int32')
+
+        cells = np.empty((num_rows, len(columns), 4), dtype='int32')
+        cells[..., 0] = x + self.CELL_MARGIN
+        cells[..., 1] = y[:, None]
+        cells[..., 2] = w - 2 * self.CELL_MARGIN
+        cells[..., 3] = np.minimum(self.CELL_HEIGHT, bottom - self.CELL_MARGIN - y)[:, None]
+
+        return cells
+
+
+    def get_integral(self, 
+                     image: CV_Image, 
+                     min: int=250, 
+                     kernel: Tuple[int]=(5,1)
+    ) -> 'np.ndarray[int]':
+        """
+        Computes the integral image of the ink of a Scoring Key box image, 
+        after the same Morphological Closing and Binary Threshold 
+        operations as self.get_contours(). The ink of any rectangle is then
+        4 lookups, see self.sum_cells().
+
+        Parameters
+        ----------
+        image : CV_Image
+            A Scoring Key box image
+
+        min : int
+            The threshold to use for the Binary Threshold operation
+
+        kernel : Tuple[int, int]
+            A solid rectangle of (width, height) that is convolved with the 
+            image during the Morphological Closing operation, see 
+            self.get_contours()
+
+        Returns
+        -------
+        np.ndarray[int]
+            An (h+1, w+1) array, the number of inked pixels above & left of
+            each pixel
+        """
+        if len(image.shape) == 3:
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+        cv_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, kernel)
+        closed = cv2.morphologyEx(image, cv2.MORPH_CLOSE, cv_kernel)
+        ink = cv2.threshold(closed, min, 1, cv2.THRESH_BINARY_INV)[1]
+
+        return cv2.integral(ink)
+
+
+    def sum_cells(self, 
+                  integral: 'np.ndarray[int]', 
+                  cells: 'np.ndarray[int]'
+    ) -> 'np.ndarray[int]':
+        """
+        Counts the inked pixels of any number of rectangles at once, from 
+        an integral image. The rectangles are clipped to the image.
+
+        Parameters
+        ----------
+        integral : np.ndarray[int]
+            The integral image returned by self.get_integral()
+
+        cells : np.ndarray[int]
+            An (..., 4) array of the (x, y, w, h) of each rectangle
+
+        Returns
+        -------
+        np.ndarray[int]
+            The number of inked pixels of each rectangle, in the shape of 
+            cells without its last axis
+        """
+        h, w = integral.shape[0] - 1, integral.shape[1] - 1
+        x0 = np.clip(cells[..., 0], 0, w)
+        y0 = np.clip(cells[..., 1], 0, h)
+        x1 = np.clip(cells[..., 0] + cells[..., 2], 0, w)
+        y1 = np.clip(cells[..., 1] + cells[..., 3], 0, h)
+
+        return integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+
+
+    def sample_cells(self, 
+                     image: CV_Image, 
+                     cells: 'np.ndarray[int]', 
+                     min: int=250, 
+                     kernel: Tuple[int]=(5,1)
+    ) -> 'np.ndarray[int]':
+        """
+        Counts the inked pixels of every cell of a Scoring Key box image. 
+        The counts are read from a single integral image of the ink, see 
+        self.get_integral(), so each cell costs 4 lookups whatever its 
+        size, and no contours are searched.
+
+        Parameters
+        ----------
+        image : CV_Image
+            A Scoring Key box image
+
+        cells : np.ndarray[int]
+            An (..., 4) array of the (x, y, w, h) of each cell, e.g. one of
+            self.cells
+
+        min : int
+            The threshold to use for the Binary Threshold operation
+
+        kernel : Tuple[int, int]
+            A solid rectangle of (width, height) that is convolved with the 
+            image during the Morphological Closing operation, see 
+            self.get_contours()
+
+        Returns
+        -------
+        np.ndarray[int]
+            The number of inked pixels of each cell, in the shape of cells
+            without its last axis
+        """
+        return self.sum_cells(self.get_integral(image, min, kernel), cells)
+
+
+    def get_category_matrix(self, min_ink: int=None) -> 'np.ndarray[bool]':
+        """
+        Decides which category cells of the Scoring Key box images are 
+        marked, by sampling the precomputed cells of both boxes, see 
+        self.sample_cells(). The result is the category table directly, 
+        without extracting any marker lines.
+
+        Parameters
+        ----------
+        min_ink : int
+            The min inked pixels of a marked cell, MIN_CELL_INK if None
+
+        Returns
+        -------
+        np.ndarray[bool]
+            A (num_questions, C) array, True where a question is marked 
+            with the category of column_names[1:]
+        """
+        if min_ink is None:
+            min_ink = self.MIN_CELL_INK
+
+        counts = [ self.sample_cells(image, cells) for image, cells in zip(self.images, self.cells) ]
+
+        return np.concatenate(counts) >= min_ink
+
+
+    def score_cells(self) -> 'np.ndarray[float]':
+        """
+        Scores how surely each category cell of the Scoring Key box images
+        holds a marker line, instead of only keeping or dropping it. One
+        integral image is computed per box, see self.get_integral(), and 
+        each cell is scored from a fixed number of lookups into it:
+
+        (1) The line response is the ink of the cell's most inked row, as 
+            a fraction of MARKER_WIDTH, up to 1. Rows whose ink continues
+            through the margins on both sides of the cell, or runs across
+            every column, are ruling lines, not marks, and give no 
+            response.
+        (2) The response is weighted by how much of the ink of the 
+            cell's band fits in MARKER_HEIGHT rows as inked as the most 
+            inked row, up to 1, so blots & strokes spread over several 
+            rows, or marks run into by a ruling line, score lower than a
+            thin line
+
+        Clean marks score ~1 and empty cells 0; the scores within 
+        UNCERTAIN_SCORES are low confidence, see self.uncertain_cells().
+
+        Returns
+        -------
+        np.ndarray[float]
+            A (num_questions, C) array, the score of each question for each 
+            category of column_names[1:]
+        """
+        scores = []
+
+        for image, cells in zip(self.images, self.cells):
+            integral = self.get_integral(image)
+
+            # Each 1 px row of each cell's band, & the margins beside it
+            rows = np.repeat(cells[..., None, :], self.CELL_HEIGHT, axis=-2)
+            rows[..., 1] += np.arange(self.CELL_HEIGHT)
+            rows[..., 3] = np.arange(self.CELL_HEIGHT) < cells[..., None, 3]
+
+            left = rows.copy()
+            left[..., 0] -= self.CELL_MARGIN
+            left[..., 2] = self.CELL_MARGIN
+            right = rows.copy()
+            right[..., 0] += rows[..., 2]
+            right[..., 2] = self.CELL_MARGIN
+
+            # A horizontal ruling line continues through the margins, which 
+            # a vertical ruling line inks at most RULE_WIDTH px of, or, 
+            # where dewarping broke it up, runs across every column
+            row_ink = self.sum_cells(integral, rows)
+            ruled = (self.sum_cells(integral, left) > self.RULE_WIDTH) \
+                    & (self.sum_cells(integral, right) > self.RULE_WIDTH)
+            ruled |= (row_ink > self.RULE_WIDTH).all(axis=1, keepdims=True)
+            line = np.where(ruled, 0, row_ink).max(axis=-1)
+
+            band_ink = self.sum_cells(integral, cells)
+
+            response = np.minimum(line / self.MARKER_WIDTH, 1)
+            concentration = np.minimum(self.MARKER_HEIGHT * line / np.maximum(band_ink, 1), 1)
+            scores.append(response * concentration)
+
+        return np.concatenate(scores)
+
+
+    def uncertain_cells(self, 
+                        scores: 'np.ndarray[float]', 
+                        marked: 'np.ndarray[bool]'=None
+    ) -> List[Tuple[int, str, float]]:
+        """
+        Lists the low confidence cells, so they can be checked by hand: the
+        cells whose scores are within UNCERTAIN_SCORES, and the cells whose
+        scores contradict the category matrix, if given.
+
+        Parameters
+        ----------
+        scores : np.ndarray[float]
+            The cell scores returned by self.score_cells()
+
+        marked : np.ndarray[bool]
+            Optional category matrix returned by self.get_category_matrix()
+
+        Returns
+        -------
+        list[tuple(int, str, float)]
+            The (question number, category, score) of each low confidence 
+            cell
+        """
+        low, high = self.UNCERTAIN_SCORES
+        column_names = self.column_names[1:]  # Omit the 'Key' (Answers) column
+
+        uncertain = (scores > low) & (scores < high)
+        if marked is not None:
+            uncertain |= (marked & (scores <= low)) | (~marked & (scores >= high))
+
+        return [
+            (int(q) + 1, column_names[c], float(scores[q, c]))
+            for q, c in zip(*np.nonzero(uncertain))
+        ]
+
+
     def filter_markers(self, contour: CV_Contour) -> bool:
         """
         A filter function that returns True if a contour is the same shape as
-        a scoring key marker line. This function is passed to python's 'filter'
-        function in self.extract_markers().
+        a scoring key marker line. Checks a single contour by the rules of 
+        self.marker_mask(); self.extract_markers() checks all contours at 
+        once.
 
         Parameters
         ----------
@@ -333,20 +907,75 @@ class ScoreKey(Box):
             True if the contour has the same shape and postion as expected
             of a marker line.
         """
-        c = contour
-        x,y,w,h = cv2.boundingRect(c)
+        rects = np.array([cv2.boundingRect(contour)])
+        return bool(self.marker_mask(rects)[0])
+
+
+    def get_bounding_rects(self, contours: list) -> 'np.ndarray[int]':
+        """
+        Computes the bounding rectangles of all contours at once.
+
+        Parameters
+        ----------
+        contours : list[CV_Contour]
+            The contours returned by cv2.findContours( ... )
+
+        Returns
+        -------
+        np.ndarray[int]
+            An (N, 4) array, 1 row of (x, y, w, h) per contour
+        """
+        rects = [cv2.boundingRect(c) for c in contours]
+        return np.array(rects, dtype='int32').reshape(-1, 4)
+
+
+    def marker_mask(self, rects: 'np.ndarray[int]') -> 'np.ndarray[bool]':
+        """
+        Applies the shape & position rules of a scoring key marker line to
+        an (N, 4) array of bounding rectangles, as boolean masks.
+
+        Parameters
+        ----------
+        rects : np.ndarray[int]
+            1 row of (x, y, w, h) per contour, see get_bounding_rects()
+
+        Returns
+        -------
+        np.ndarray[bool]
+            True for each rectangle the same shape and position as expected
+            of a marker line
+        """
+        x, y, w, h = rects.T
         area = w*h
-        aspect = float(w)/h
-
-        if (
-            aspect < 2 or 
-            area < 20 or
-            w < 15 or w > 30 or h > 5 or
-            y < 80 or x < 60
-        ):
-            return False
-        else:
-            return True
+        aspect = w / h
+
+        return (
+            (aspect >= 2) & 
+            (area >= 20) &
+            (w >= 15) & (w <= 30) & (h <= 5) &
+            (y >= 80) & (x >= 60)
+        )
+
+
+    def extract_marker_boxes(self, contours: list) -> Tuple['np.ndarray[int]']:
+        """
+        Finds the marker lines in a list of contours, computing every 
+        bounding rectangle once and filtering them all at once.
+
+        Parameters
+        ----------
+        contours : list[CV_Contour]
+            The list of candidate contours returned by cv2.findContours( ... )
+
+        Returns
+        -------
+        tuple(np.ndarray[int], np.ndarray[int])
+            The indexes of the marker lines in contours, and their (M, 4)
+            array of bounding rectangles (x, y, w, h)
+        """
+        rects = self.get_bounding_rects(contours)
+        indexes = np.flatnonzero(self.marker_mask(rects))
+        return indexes, rects[indexes]
         
     
     def extract_markers(self, contours: list) -> list:
@@ -363,7 +992,8 @@ class ScoreKey(Box):
         list[CV_Contour]
             The list of contours representing score key marker lines
         """
-        markers = list(filter(self.filter_markers, list(contours)))
+        indexes, _ = self.extract_marker_boxes(contours)
+        markers = [contours[i] for i in indexes]
         return markers
 
     
@@ -1,122 +1,422 @@
 # Pipeline
 # Input pdf should contain only the ScoreKey pages and the Scoring Table page 
 # (4 pages total)
+#
+# Run it as a script, see the README, or import it and call run_pipeline()
 
-import os, sys, cv2
+import os, re, sys, cv2
 import pickle
 import argparse
+import tempfile
+import multiprocessing
 import numpy as np
 import pandas as pd
 from os.path import join, abspath
 from dataclasses import dataclass
 import pytesseract as pt
 from pytesseract import Output
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, convert_from_bytes
 from imutils.contours import sort_contours
+from typing import Iterator, Union
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from jinja2 import Environment, FileSystemLoader
+
 
+SRC_DIR = os.path.dirname(abspath(__file__))
 
-sys.path.append('./classes')
+sys.path.append(join(SRC_DIR, 'classes'))
 from classes.dewarper import Dewarper
 from classes.deshadower import Deshadower
+from featureCache import FeatureCache
+from dewarpSession import DewarpSession
 from scoreKey import Box, Marker, ScoreKey, Column
 from sheetUtilities import SheetUtilities
 
 util = SheetUtilities()
 
-### Get CLI arguments
-ap = argparse.ArgumentParser()
-ap.add_argument('--test_code', '-tc', required=True, help='test code in yyyymm format')
-ap.add_argument('--pdf_path', '-p', required=True, help='path/to/pdf_file')
-args = ap.parse_args()
-
-PATH = abspath(args.pdf_path)
-PATH_REF = abspath("./images/all.pdf")
-print(PATH)
-
-### Get reference images
-refs = convert_from_path(PATH_REF)
-for i, p in enumerate(refs):
-    p = p.resize((850, 1100))
-    p = np.asarray(p, dtype='uint8')
-    refs[i] = p
-
-### Get PDF pages, convert to each PNG
-pils = convert_from_path(PATH)#[0]  # <-- PIL Image
-for i, p in enumerate(pils):
-    if i > 3:
-        break
-    p = p.resize((850, 1100))
-    p = np.asanyarray(p, dtype='uint8')
-    p = cv2.cvtColor(p, cv2.COLOR_RGB2BGR)
-    
-    # Introduces color artifacts
-    # d = Deshadower(p)
-    # p = d.deshadow()
-
-    d = Dewarper(refs[i], p)
-    d.dewarp()
-    pils[i] = d.dewarped
-
 
-# Full page images
-images = dict.fromkeys(['e', 'm', 'r', 's', 'score_table'])
-images['e'] = pils[0]
-images['m'] = pils[1]
-images['r'] = pils[2]
-images['s'] = pils[2]
-images['score_table'] = pils[3]
-
-# print("\n", type(images['e']), sep='')
-
-### Extract the Scorekeys from Each Page
-# @TODO Extract the Scoring Table from final page
-score_keys = {}
-score_keys['e'] = ScoreKey('e', images['e'])
-score_keys['m'] = ScoreKey('m', images['m'])
-score_keys['r'] = ScoreKey('r', images['r'])
-score_keys['s'] = ScoreKey('s', images['s'])
+def build_parser() -> argparse.ArgumentParser:
+    """
+    Builds the CLI argument parser. Its defaults are also the defaults of
+    the options of run_pipeline().
+    """
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--test_code', '-tc', help='test code in yyyymm format')
+    ap.add_argument('--pdf_path', '-p', help='path/to/pdf_file')
+    ap.add_argument('--batch', '-b', help='path/to/directory of yyyymm.pdf files, or path/to/manifest.csv of "test_code,pdf_path" lines')
+    ap.add_argument('--output_dir', '-o', default=join(SRC_DIR, 'categories'), help='path/to/directory the category json files are written to')
+    ap.add_argument('--cache_dir', '-c', default=join(SRC_DIR, 'cache'), help='path/to/reference/feature/cache')
+    ap.add_argument('--shared_index', action='store_true', help='match against a prebuilt, cached FLANN index of each reference')
+    ap.add_argument('--workers', '-w', type=int, default=1, help='number of processes dewarping & scanning pages in parallel')
+    ap.add_argument('--detector', default='sift', choices=sorted(Dewarper.BACKENDS), help='the feature detector used to dewarp the pages')
+    ap.add_argument('--pyramid', type=float, default=None, metavar='SCALE', help='detect keypoints on pages downscaled by SCALE, e.g. 0.5, then refine the homography at full size')
+    ap.add_argument('--fast_path', action='store_true', help="don't dewarp pages that are already aligned with the reference pages")
+    ap.add_argument('--reuse_homography', action='store_true', help="start each page's homography from the previous page's")
+    ap.add_argument('--fallback', nargs='+', default=[], choices=['ratio', *sorted(Dewarper.BACKENDS), 'identity'], help='what to try, in order, when a page\'s homography is missing or poor')
+    ap.add_argument('--masked', action='store_true', help='detect keypoints only around the Scoring Key box borders & headers')
+    ap.add_argument('--max_keypoints', type=int, default=0, help='keep only the N strongest keypoints of each image, 0 for all')
+    ap.add_argument('--unordered', action='store_true', help='identify the reference page of each pdf page, for pdfs whose pages are reordered or missing')
+    ap.add_argument('--cells', action='store_true', help='sample the known cells of the boxes for marks, instead of searching for marker lines')
+    ap.add_argument('--grid', action='store_true', help="find each marker's row & column from the ruling lines & baselines of the box")
+    ap.add_argument('--components', action='store_true', help='extract the marker lines as connected components instead of contours')
+    ap.add_argument('--full_page', action='store_true', help='dewarp whole pages instead of only the Scoring Key boxes')
+    ap.add_argument('--build_refs', action='store_true', help='rebuild the precomputed reference page rasters, then exit')
+
+    return ap
+
+
+def get_options(options: dict=None) -> argparse.Namespace:
+    """
+    Returns the CLI defaults, overridden by options given by CLI argument
+    name, e.g. {'workers': 2, 'detector': 'orb'}. Raises a ValueError for 
+    an unknown option.
+    """
+    namespace = build_parser().parse_args([])
+
+    for name, value in (options or {}).items():
+        if not hasattr(namespace, name):
+            raise ValueError(f"Unknown option {name!r}, the options are {sorted(vars(namespace))}")
+        setattr(namespace, name, value)
+
+    return namespace
+
+
+PATH_REF = join(SRC_DIR, 'images', 'all.pdf')
+PATH_REF_RASTERS = join(SRC_DIR, 'images', 'all.npy')  # Precomputed reference pages
+PATH_TEMPLATES = join(SRC_DIR, 'categories')  # The category json template
+PAGE_SIZE = (850, 1100)  # (width, height) of a page image in px
+PAGE_DPI = 100  # The resolution that renders a Letter size page at PAGE_SIZE
 
 show_images = False  # Control Flag for viewing intermediate images
-
-if show_images:
-	for code in ('e', 'm', 'r', 's'):
-		cv2.imshow(f'{code}1', score_keys[code].images[0])
-		cv2.imshow(f'{code}2', score_keys[code].images[1])
-		if cv2.waitKey(0) == 27:
-		    break
-	cv2.destroyAllWindows()
-
-
-### Find all category marks in the Scoring Box images
-# @TODO Denoise the photo images and erode the convolution before 
-# extracting contours
-for code in ('e', 'm', 'r', 's'):
-    sk = score_keys[code]
+show_markers = False  # Control Flag for viewing extracted markers, set by the CLI
+
+# The sections whose Scoring Keys are on each page. The 4th page is the 
+# Scoring Table.
+PAGE_SECTIONS = (('e',), ('m',), ('r', 's'), ())
+
+MASK_SLACK = 40  # The max displacement in px of a skewed page's landmarks, for --masked
+
+# Everything shared by all pdfs, set up by configure()
+args = None  # The options in effect, an argparse.Namespace
+cache = None  # The reference feature cache
+refs = None  # The reference page images
+stack = None  # The page stack, see open_page_stack()
+stack_dir = None  # The temporary directory of a memory-mapped page stack
+stack_path = None
+session = None  # The DewarpSession holding the prepared reference pages
+executor = None  # The page worker processes, if --workers > 1
+template = None  # The category json template
+
+# The homography of the last page dewarped, for --reuse_homography
+homography_seed = None
+
+
+def rasterize(pdf: Union[str, bytes], num_pages: int=None, out: 'np.ndarray'=None, 
+              first_page: int=1) -> list:
+    """
+    Rasterizes num_pages pages (all pages if None) of a pdf file or of the
+    bytes of a pdf, starting at page number first_page, directly into 
+    850 x 1100 px grayscale page images. Pages stay single channel from 
+    here through contour extraction. Letter size pages are rendered at 
+    100 dpi, so no page is rendered larger than needed and no pages are 
+    rendered only to be discarded. If 'out' is given, the i-th page 
+    rendered is written into out[i] and the returned pages are views into
+    'out'. Pages past the end of the pdf aren't returned.
+    """
+    last_page = None if num_pages is None else first_page + num_pages - 1
+    convert = convert_from_bytes if isinstance(pdf, bytes) else convert_from_path
+    pils = convert(pdf, dpi=PAGE_DPI, first_page=first_page, last_page=last_page,
+                   grayscale=True, size=PAGE_SIZE)  # <-- PIL Images
+
+    if out is None:
+        pages = [np.asarray(p, dtype='uint8') for p in pils]
+    else:
+        for i, p in enumerate(pils):
+            out[i] = np.asarray(p, dtype='uint8')
+        pages = list(out[:len(pils)])
+
+    return pages
+
+
+def build_references(path: str, path_rasters: str) -> 'np.ndarray':
+    """
+    Rasterizes the reference pdf and saves the pages as a single uint8 
+    array of shape (num_pages, 1100, 850) in a .npy file.
+    """
+    refs = np.stack(rasterize(path))
+
+    # Write to a temp file & rename, so a concurrent run never memory-maps
+    # a partially written file
+    tmp = f"{path_rasters}.{os.getpid()}.tmp.npy"
+    np.save(tmp, refs)
+    os.replace(tmp, path_rasters)
+    print(f"Saved {len(refs)} reference pages to {path_rasters}")
+
+    return refs
+
+
+def get_references(path: str, path_rasters: str) -> 'np.ndarray':
+    """
+    Memory-maps the precomputed 850 x 1100 px reference page images. The
+    rasters are (re)built from the reference pdf first if they are missing
+    or older than the pdf.
+
+    Returns
+    -------
+    ndarray
+        A read-only, memory-mapped array of shape (num_pages, 1100, 850);
+        refs[i] is the reference image of page i
+    """
+    if (not os.path.isfile(path_rasters) 
+        or os.path.getmtime(path_rasters) < os.path.getmtime(path)):
+        build_references(path, path_rasters)
+
+    return np.load(path_rasters, mmap_mode='r')
+
+
+def open_page_stack(path: str=None) -> 'np.ndarray':
+    """
+    Allocates the page stack, a uint8 array of shape (8, 1100, 850) reused
+    for every pdf. Slots 0-3 hold the rasterized pages of the current pdf
+    and, with --full_page, slots 4-7 its dewarped pages. If a path is 
+    given, the stack is a memory-mapped file, which worker processes open
+    to read and write the pages in place.
+    """
+    shape = (2 * len(PAGE_SECTIONS), PAGE_SIZE[1], PAGE_SIZE[0])
+
+    if path is None:
+        return np.zeros(shape, dtype='uint8')
+
+    return np.lib.format.open_memmap(path, mode='w+', dtype='uint8', shape=shape)
+
+
+def iter_pages(pdf: Union[str, bytes]) -> Iterator[int]:
+    """
+    Rasterizes the first 4 pages of a scoring key pdf into the page stack 
+    as 850 x 1100 px page images, then yields the index of each page, so
+    each is scanned and its results passed on before the next page is 
+    touched. The pages are rendered by a single call, since each call 
+    starts its own pdfinfo & pdftoppm processes, and copies pdf bytes to 
+    a temp file. Stops early at the end of a shorter pdf.
+    """
+    pages = rasterize(pdf, num_pages=len(PAGE_SECTIONS), out=stack)
+
+    for i in range(len(pages)):
+        # Introduces color artifacts
+        # d = Deshadower(stack[i])
+        # stack[i] = d.deshadow()
+
+        yield i
+
+
+def init_worker(worker_session: DewarpSession, stack_path: str) -> None:
+    """
+    Initializes a page worker process with the dewarp session, which holds
+    the prepared reference pages, and the memory-mapped page stack.
+    """
+    global session, stack
+    session = worker_session
+    stack = np.load(stack_path, mmap_mode='r+')
+
+
+def make_session() -> DewarpSession:
+    """
+    Creates the DewarpSession that dewarps every page, configured from the
+    CLI arguments, and prepares reference page i under the name i. With
+    --masked, keypoints are only detected around the borders & headers of
+    the page's Scoring Key boxes; the image mask is widened by MASK_SLACK
+    pixels to allow for the page's skew. With --unordered, every reference
+    page is prepared, so that each can be identified.
+    """
+    session = DewarpSession(cache=cache, shared_index=args.shared_index, 
+                            grayscale=True, max_keypoints=args.max_keypoints,
+                            detector=args.detector, pyramid_scale=args.pyramid,
+                            fallbacks=tuple(args.fallback))
+
+    for i, ref in enumerate(refs):
+        boxes = [box for code in PAGE_SECTIONS[i] for box in ScoreKey(code).tables]
+
+        # @TODO Extract the Scoring Table from final page
+        if not boxes and not args.full_page and not args.unordered:
+            continue
+
+        ref_mask, img_mask = None, None
+        if args.masked and boxes:
+            ref_mask = Dewarper(ref).mask_from_boxes(boxes)
+            slack = np.ones((2*MASK_SLACK + 1, 2*MASK_SLACK + 1), dtype='uint8')
+            img_mask = cv2.dilate(ref_mask, slack)
+
+        session.add_reference(i, ref, ref_mask, img_mask)
+
+    return session
+
+
+def scan_page(i: int) -> tuple:
+    """
+    Dewarps the Scoring Key boxes of page i of the page stack against its 
+    reference page, then extracts the category marks of each section on 
+    the page. Runs in the parent process or in a page worker process. 
+
+    Page i's reference page is page i of the reference pdf, unless 
+    --unordered is set; then it's identified by DewarpSession.classify(),
+    and a page that can't be identified is skipped. The keypoints detected
+    to identify the page are reused to dewarp it, unless it's --masked.
+    
+    Only the box regions are dewarped, unless --full_page is set; then the
+    whole page is dewarped into the page's dewarped slot of the stack. With
+    --fast_path, a page that is already aligned with its reference page is 
+    cropped directly instead of being dewarped. With --reuse_homography, 
+    the page is dewarped starting from the previous page's homography.
+
+    Returns
+    -------
+    tuple(str, dict)
+        The path the page took: 'aligned', 'seeded' (dewarped by the 
+        previous page's homography), 'dewarped', '<fallback> fallback', 
+        'skipped', or 'unidentified'; and the category marks of each 
+        section on the page
+            Key : str
+                A section code, 'e', 'm', 'r', 's'
+            Val : dict
+                The section's category_marks
+    """
+    global homography_seed
+
+    page = stack[i]
+    r = i  # The reference page
+    features = None  # The page's keypoints, if already detected
+
+    if args.unordered:
+        r, votes, features = session.classify(page)
+        print(f"Page {i+1} reference page votes: {votes}")
+        if r is None:
+            return 'unidentified', {}
+        print(f"Page {i+1} is reference page {r+1}")
+
+    sections = [ScoreKey(code, grayscale=True) for code in PAGE_SECTIONS[r]]
+    boxes = [box for sk in sections for box in sk.tables]
+
+    # @TODO Extract the Scoring Table from final page
+    if not sections and not args.full_page:
+        return 'skipped', {}
+
+    d = session.get_dewarper(r, page, homography_seed if args.reuse_homography else None, features)
+    path = 'dewarped'
+
+    if args.fast_path and d.is_aligned(boxes):
+        path = 'aligned'
+        if args.full_page:
+            for sk in sections:
+                sk.load_page(page)
+        else:
+            regions = [ page[b.y:b.y+b.h, b.x:b.x+b.w] for b in boxes ]
+            for j, sk in enumerate(sections):
+                sk.load_images(regions[2*j:2*j+2])
+    elif args.full_page:
+        dewarped = stack[len(PAGE_SECTIONS) + i]
+        d.dewarp(dst=dewarped)
+        for sk in sections:
+            sk.load_page(dewarped)
+    else:
+        regions = d.dewarp(regions=boxes)
+        for j, sk in enumerate(sections):
+            sk.load_images(regions[2*j:2*j+2])
+
+    if path == 'dewarped':
+        print(f"Page {i+1} homography: {d.homography_source}, {d.quality}")
+
+    if path == 'dewarped' and d.homography_source in args.fallback:
+        path = f"{d.homography_source} fallback"
+    elif path == 'dewarped' and args.reuse_homography:
+        homography_seed = d.transformation_matrix
+        if d.homography_source == 'seed':
+            path = 'seeded'
+
+    if show_images:
+        for sk in sections:
+            cv2.imshow(f'{sk.section_code}1', sk.images[0])
+            cv2.imshow(f'{sk.section_code}2', sk.images[1])
+            cv2.waitKey(0)
+        cv2.destroyAllWindows()
+
+    category_marks = {}
+    for sk in sections:
+        extract_section_marks(sk)
+        category_marks[sk.section_code] = sk.category_marks
+
+    return path, category_marks
+
+
+def extract_section_marks(sk: ScoreKey) -> None:
+    """
+    Finds all category marks in the Scoring Box images of a ScoreKey and 
+    inserts them into its 'category_marks'. With --components, the marks
+    are found among the connected components of the images instead of 
+    their contours, and the Markers have no contour. With --grid, each 
+    marker's row & column are looked up in the grid of its box, see 
+    ScoreKey.detect_grid(), instead of being inferred from the positions
+    of all the markers. With --cells, no marker lines are searched for: 
+    the cells laid out from the table geometry are sampled for ink, see 
+    ScoreKey.get_category_matrix(), and each Marker is a marked cell. The
+    cells scored as low confidence, see ScoreKey.score_cells(), are 
+    printed for checking.
+    """
+    # @TODO Denoise the photo images and erode the convolution before 
+    # extracting contours
+    code = sk.section_code
+
+    if args.cells:
+        # Each row's marks are listed right to left, the order of the 
+        # contours, so marks are listed the same way
+        cells = np.concatenate(sk.cells)
+        marked = sk.get_category_matrix()
+        for q, c in zip(*np.nonzero(marked[:, ::-1])):
+            c = marked.shape[1] - 1 - c
+            m = Marker(None, cells[q, c])
+            m.row = int(q) + 1
+            m.column = sk.column_names[c + 1]  # Omit the 'Key' (Answers) column
+            sk.category_marks[m.row] = sk.category_marks[m.row] + [m]
+
+        for q, category, score in sk.uncertain_cells(sk.score_cells(), marked):
+            print(f"Section '{code}' question {q} {category}: low confidence cell, score {score:.2f}")
+        return
 
     for i, image in enumerate(sk.images):
-        contours = sk.get_contours(image, 250, 255, kernel=(5,1))
-
-        for j,c in enumerate(contours):
-            x,y,w,h = cv2.boundingRect(c)
+        if args.components:
+            # The bounding rects come straight from the component stats.
+            # Components are labeled in raster order; reversed, they're in
+            # the order of the contours, so marks are listed the same way.
+            contours = None
+            rects = sk.get_components(image, 250, 255, kernel=(5,1))[::-1, :4]
+        else:
+            contours = sk.get_contours(image, 250, 255, kernel=(5,1))
+
+            # The bounding rects of all contours are computed once, then 
+            # filtered all at once and reused by the Markers
+            rects = sk.get_bounding_rects(contours)
+
+        for j,(x,y,w,h) in enumerate(rects.tolist()):
             area = w*h
             aspect = round(float(w)/h, 5)
             print(f"{j}\tx:{x}, y:{y}, w:{w}, h:{h}, area:{area}, aspect:{aspect}")
-
-            pic = sk.images[i].copy()
-            cv2.drawContours(pic, [c], -1, (0,0,255), 1)
             
             if show_images:
-    	        cv2.imshow("Contour", pic)
-    	        if cv2.waitKey(0) == 27:
-    	            break
-            cv2.destroyAllWindows()
+                pic = cv2.cvtColor(sk.images[i], cv2.COLOR_GRAY2BGR)
+                if contours is None:
+                    cv2.rectangle(pic, (x, y), (x+w-1, y+h-1), (0,0,255), 1)
+                else:
+                    cv2.drawContours(pic, [contours[j]], -1, (0,0,255), 1)
+                cv2.imshow("Contour", pic)
+                if cv2.waitKey(0) == 27:
+                    break
+                cv2.destroyAllWindows()
         
         # sys.exit()
-        markers = sk.extract_markers(contours)
+        indexes = np.flatnonzero(sk.marker_mask(rects))
 
         # debugging loop
-        # for j, c in enumerate(markers):
-        #     x,y,w,h = cv2.boundingRect(c)
+        # for j, (x,y,w,h) in zip(indexes, rects[indexes].tolist()):
+        #     c = contours[j]
         #     area = w*h
         #     aspect = round(float(w)/h, 3)
         #     print(f"x:{x}  y:{y}  w:{w}  h:{h}  area:{area}  aspect:{aspect}")
@@ -127,39 +427,50 @@ for code in ('e', 'm', 'r', 's'):
         #         break
         #     cv2.destroyAllWindows()
         
-        markers = [Marker(c) for c in markers] # Unordered list
+        markers = [Marker(None if contours is None else contours[j], rects[j]) 
+                   for j in indexes] # Unordered list
 
-        # Find the unique x, y coordinates of the category marks
-        sk.unique_x = util.extract_unique_1D([m.box.x for m in markers], 5)
-        sk.unique_y = util.extract_unique_1D([m.box.y for m in markers], 5)
-        # print(i, code, sk.unique_x, sep=': ')
+        # offset for merging 1st & 2nd image questions into single collection
+        j0 = int(0.5 * sk.num_questions + 0.5) if i == 1 else 0
+
+        if args.grid:
+            # Look up each marker's row & column in the grid of the box
+            grid = sk.detect_grid(image, first_row=j0+1)
+            rows, cols = sk.locate_markers(grid, rects[indexes])
+            inside = (rows > 0) & (cols > 0)  # Not in the 'Key' column or on a line
+            markers = [m for m, keep in zip(markers, inside) if keep]
+            for m, row, col in zip(markers, rows[inside].tolist(), cols[inside].tolist()):
+                m.row = row
+                m.column = sk.column_names[col]
+        else:
+            # Find the unique x, y coordinates of the category marks
+            sk.unique_x = util.extract_unique_1D([m.box.x for m in markers], 5)
+            sk.unique_y = util.extract_unique_1D([m.box.y for m in markers], 5)
+            # print(i, code, sk.unique_x, sep=': ')
         
-        # Align marker (x, y) to closest unique values
-        for m in markers:
-            x = m.box.x
-            x = min(sk.unique_x, key=lambda el:abs(el-x))
-            # print(code, " x:", m.box.x, '->', x)
-            m.box.x = x
+            # Align marker (x, y) to closest unique values
+            for m in markers:
+                x = m.box.x
+                x = min(sk.unique_x, key=lambda el:abs(el-x))
+                # print(code, " x:", m.box.x, '->', x)
+                m.box.x = x
 
-            y = m.box.y 
-            y = min(sk.unique_y, key=lambda el:abs(el-y))
-            m.box.y = y
+                y = m.box.y 
+                y = min(sk.unique_y, key=lambda el:abs(el-y))
+                m.box.y = y
 
 
-        # Create indexing dicts
-        column_names = sk.column_names[1:]  # Omit the 'Key' (Answers) column
-        col_index =  dict(zip(sk.unique_x, column_names))
+            # Create indexing dicts
+            column_names = sk.column_names[1:]  # Omit the 'Key' (Answers) column
+            col_index =  dict(zip(sk.unique_x, column_names))
 
-        row_index = dict(zip(sk.unique_y, range(1, len(sk.unique_y)+1)))
-        # offset for merging 1st & 2nd image questions into single collection
-        if i == 1:
-            j0 = int(0.5 * sk.num_questions + 0.5)
+            row_index = dict(zip(sk.unique_y, range(1, len(sk.unique_y)+1)))
             row_index = {k:v+j0 for (k,v) in row_index.items()}
 
-        # Insert row and column values into each Marker
-        for m in markers:
-            m.row = row_index[m.box.y]
-            m.column = col_index[m.box.x]
+            # Insert row and column values into each Marker
+            for m in markers:
+                m.row = row_index[m.box.y]
+                m.column = col_index[m.box.x]
 
         # for m in markers:
         #     print(i, m.row, m.column, m.box)
@@ -167,7 +478,6 @@ for code in ('e', 'm', 'r', 's'):
             
         # Insert line marker into appropriate question
         for m in markers:
-            key = row_index[m.box.y]
             key = m.row
             # print(i, j, y, key, sk.category_marks[key])
             if sk.category_marks[key]:
@@ -176,13 +486,19 @@ for code in ('e', 'm', 'r', 's'):
                 sk.category_marks[key] = [m]
 
         # Show extracted markers
-        pic = image.copy()
-        lines = [m.contour for m in markers]
-        cv2.drawContours(pic, lines, -1, (0,0,255), 1)
-        cv2.imshow(f"{code}{i+1} Markers", pic)
-        print("\nPress ESCAPE \n")
-        cv2.waitKey(0) 
-    cv2.destroyAllWindows()
+        if show_markers:
+            pic = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if contours is None:
+                for x, y, w, h in rects[indexes].tolist():
+                    cv2.rectangle(pic, (x, y), (x+w-1, y+h-1), (0,0,255), 1)
+            else:
+                lines = [m.contour for m in markers]
+                cv2.drawContours(pic, lines, -1, (0,0,255), 1)
+            cv2.imshow(f"{code}{i+1} Markers", pic)
+            print("\nPress ESCAPE \n")
+            cv2.waitKey(0) 
+    if show_markers:
+        cv2.destroyAllWindows()
 
     for k, marks in sk.category_marks.items():
         for m in marks:
@@ -190,94 +506,364 @@ for code in ('e', 'm', 'r', 's'):
     print('\n----------------------------------------------------------------\n')
     # A-OK here
 
-### Build dict to hold template values
-all_template_values = {'test_code':f'"{str(args.test_code)}"'}
-for code in ('e', 'm', 'r', 's'):
-    sk = score_keys.get(code)
-    template_values = {}
-    
-    for q, marks in sk.category_marks.items():
-        key = f"{code}C{q}"
-        # cats = str([m.column for m in marks])
-        # cats = cats.replace(['[',']'], '') # for json compliance
-        cats = ''
-        for j, m in enumerate(marks):
-            cats += f'"{m.column}"' 
-            if j < len(marks)-1:
-                cats += ', '
-
-        cats = cats.replace("'", '"') # for json compliance
-        template_values[key] = cats
-
-    all_template_values.update(template_values)
-    print(code)
-
-for k,v in all_template_values.items():
-    print(k,v)
-
-### Insert 
-from jinja2 import Environment, FileSystemLoader
-env = Environment(loader=FileSystemLoader('./categories'))
-template = env.get_template( "cat_ACT_Official.json" )
-json_string = template.render(all_template_values)
-print('')
-print(json_string)
-
-outfile = f'categories/cat_ACT_Official_{args.test_code}.json'
-with open(outfile, 'w') as f:
-    f.write(json_string)
-
-
-sys.exit()
-
-
-### Build DataFrame to hold Category Values
-for code in ('e', 'm', 'r', 's'):
-    sk = score_keys[code]
-    column_names = sk.column_names[1:]  # Omit the 'Key' (Answers) column
-
-    num_rows = sk.num_questions
-    num_cols = len(column_names)
-
-    array = np.zeros((num_rows, num_cols), dtype='bool')
-    df = pd.DataFrame(data=array, index=range(1, num_rows+1), columns=column_names)
-    sk.category_dataframe = df
-
-    # with pd.option_context('display.max_rows', None): 
-    #     label = {'e':'English', 'm':'Math', 'r':'Reading', 's':'Science'}
-    #     print(label[code])
-    #     print(df, '\n\n')
-
-    # for marks in sk.category_marks.values():
-    #     for m in marks:
-    #         print(code, m.row, m.column, m.box)
 
-    # print('\n----------------------------------------------------------------\n')
-
-
-
-### Populate dataframe with category data based on positions of marker lines
-for code in ('e', 'm', 'r', 's'):
-    sk = score_keys[code]
-    df = sk.category_dataframe
-
-    # for marks in sk.category_marks.values():
-    #     for m in marks:
-    #         print(code, m.row, m.column, m.box)
+def render_categories(category_marks: dict, test_code: str) -> str:
+    """
+    Injects the category marks of each section into the category json 
+    template and returns the json string. The categories of a missing 
+    section are left empty.
+    """
+    ### Build dict to hold template values
+    all_template_values = {'test_code':f'"{str(test_code)}"'}
+    for code in ('e', 'm', 'r', 's'):
+        template_values = {}
+        
+        for q, marks in category_marks.get(code, {}).items():
+            key = f"{code}C{q}"
+            # cats = str([m.column for m in marks])
+            # cats = cats.replace(['[',']'], '') # for json compliance
+            cats = ''
+            for j, m in enumerate(marks):
+                cats += f'"{m.column}"' 
+                if j < len(marks)-1:
+                    cats += ', '
+
+            cats = cats.replace("'", '"') # for json compliance
+            template_values[key] = cats
+
+        all_template_values.update(template_values)
+        print(code)
+
+    for k,v in all_template_values.items():
+        print(k,v)
+
+    ### Insert 
+    json_string = template.render(all_template_values)
+    print('')
+    print(json_string)
+
+    return json_string
+
+
+def scan_pdf(pdf: Union[str, bytes], executor: ProcessPoolExecutor=None) -> Iterator[tuple]:
+    """
+    Streams a scoring key pdf through the pipeline: each page is 
+    rasterized, dewarped, cropped, and its category marks extracted, one
+    page at a time. The category marks of each section are yielded as 
+    soon as its page is done, so they can be consumed while later pages 
+    are still being scanned. If an executor is given, each page is 
+    submitted to its worker processes as soon as it's rasterized, and the
+    sections are yielded in the order their pages finish.
+
+    Yields
+    ------
+    tuple(str, dict)
+        A section code, 'e', 'm', 'r', 's', and the section's 
+        category_marks
+    """
+    global homography_seed
+    homography_seed = None
+
+    if executor is None:
+        results = ((i, scan_page(i)) for i in iter_pages(pdf))
+    else:
+        futures = {executor.submit(scan_page, i): i for i in iter_pages(pdf)}
+        results = ((futures[f], f.result()) for f in as_completed(futures))
+
+    for i, (page_path, category_marks) in results:
+        print(f"Page {i+1}: {page_path}")
+        yield from category_marks.items()
+
+
+def process_pdf(pdf: Union[str, bytes], test_code: str, executor: ProcessPoolExecutor=None) -> dict:
+    """
+    Runs the full pipeline on a single scoring key pdf, given by path or
+    as bytes, and writes the category json file for its test code to the
+    --output_dir, unless it's None. If an executor is given, the pages are
+    dewarped and scanned in parallel by its worker processes.
+
+    Returns
+    -------
+    dict
+        Key : str
+            'e', 'm', 'r', 's'
+        Val : dict
+            The category_marks of each section found
+    """
+    if isinstance(pdf, bytes):
+        print(f"<pdf of {len(pdf)} bytes>")
+    else:
+        pdf = abspath(pdf)
+        print(pdf)
+
+    ### Collect the category marks of each section as its page is scanned
+    category_marks = {}
+    found = []
+    for code, marks in scan_pdf(pdf, executor):
+        category_marks[code] = marks
+        found.append(code)
+
+    if args.unordered:
+        for code in sorted(set(found)):
+            if found.count(code) > 1:
+                print(f"Section '{code}' was found on {found.count(code)} pages, the last is used")
+        for code in ('e', 'm', 'r', 's'):
+            if code not in found:
+                print(f"Section '{code}' wasn't found, its categories are empty")
+
+    json_string = render_categories(category_marks, test_code)
+
+    if args.output_dir is not None:
+        outfile = join(args.output_dir, f'cat_ACT_Official_{test_code}.json')
+        with open(outfile, 'w') as f:
+            f.write(json_string)
+
+    return category_marks
+
+
+def category_map(category_marks: dict) -> dict:
+    """
+    Maps the category marks of each section to the names of the marked
+    categories, the values the category json is rendered from.
+
+    Returns
+    -------
+    dict
+        Key : str
+            'e', 'm', 'r', 's'
+        Val : dict
+            Key : int
+                A question number
+            Val : list[str]
+                The question's categories, e.g. ['POW']
+    """
+    return {
+        code: { q: [m.column for m in marks] for q, marks in section.items() }
+        for code, section in category_marks.items()
+    }
+
+
+def category_dataframes(category_marks: dict) -> dict:
+    """
+    Tabulates the category marks of each section as a boolean DataFrame,
+    with 1 row per question and 1 column per category.
+
+    Returns
+    -------
+    dict
+        Key : str
+            'e', 'm', 'r', 's'
+        Val : pd.DataFrame
+            The section's categories, True where a question is marked
+    """
+    dataframes = {}
+
+    ### Build DataFrame to hold Category Values
+    for code in ('e', 'm', 'r', 's'):
+        sk = ScoreKey(code, grayscale=True)
+        column_names = sk.column_names[1:]  # Omit the 'Key' (Answers) column
 
-    # print('\n----------------------------------------------------------------\n')
+        num_rows = sk.num_questions
+        num_cols = len(column_names)
+
+        array = np.zeros((num_rows, num_cols), dtype='bool')
+        df = pd.DataFrame(data=array, index=range(1, num_rows+1), columns=column_names)
+
+        ### Populate dataframe with category data based on positions of marker lines
+        for marks in category_marks.get(code, {}).values():
+            for m in marks:
+                df.loc[m.row, m.column] = True
+
+        dataframes[code] = df
+
+    return dataframes
+
+
+def read_batch(path: str) -> list:
+    """
+    Lists the (test_code, pdf_path) pairs of a batch. The batch is either a
+    directory of pdf files named by test code, e.g. '202306.pdf', or a 
+    manifest file with one "test_code,pdf_path" pair per line. Relative pdf
+    paths in a manifest are relative to the manifest's directory. Malformed
+    manifest lines are reported and skipped.
+    """
+    jobs = []
+
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() != '.pdf':
+                continue
+            match = re.search(r'\d{6}', stem)
+            test_code = match.group() if match else stem
+            jobs.append((test_code, join(path, name)))
+    else:
+        with open(path) as f:
+            for n, line in enumerate(f, 1):
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                fields = [v.strip() for v in line.split(',', 1)]
+                if len(fields) != 2 or not all(fields):
+                    print(f"Skipped line {n} of {path}, it isn't a \"test_code,pdf_path\" pair: {line!r}")
+                    continue
+                test_code, pdf_path = fields
+                jobs.append((test_code, join(os.path.dirname(abspath(path)), pdf_path)))
+
+    return jobs
+
+
+def configure(options: Union[dict, argparse.Namespace]=None) -> argparse.Namespace:
+    """
+    Sets up everything shared by all pdfs: the reference pages, feature 
+    cache, page stack, dewarp session, worker processes, and json template.
+    They are set up once per set of options; calling it again with the 
+    same options reuses them, so a long running process only pays for 
+    them once.
+
+    Parameters
+    ----------
+    options : dict or argparse.Namespace
+        The options by CLI argument name, e.g. {'workers': 2}; any option
+        not given takes its CLI default, see get_options()
+
+    Returns
+    -------
+    argparse.Namespace
+        The options in effect
+    """
+    global args, cache, refs, stack, stack_dir, stack_path, session, executor, template
+
+    if not isinstance(options, argparse.Namespace):
+        options = get_options(options)
+
+    if options == args:
+        return args
+
+    if options.reuse_homography and options.workers > 1:
+        raise ValueError("--reuse_homography scans the pages in order, it can't be used with --workers")
+
+    if executor is not None:
+        executor.shutdown()
+
+    executor = None
+    args = options
+
+    # A failed setup is redone by the next call, even with the same options
+    try:
+        ### Load everything shared by all pdfs once: references, cache, template
+        # Reference keypoint descriptors are computed once, then reused across runs
+        cache = FeatureCache(abspath(args.cache_dir))
+
+        ### Get reference images
+        refs = get_references(PATH_REF, PATH_REF_RASTERS)
+
+        # Batches and worker processes share a memory-mapped page stack on disk
+        stack_dir = None
+        stack_path = None
+        if args.batch is not None or args.workers > 1:
+            stack_dir = tempfile.TemporaryDirectory()
+            stack_path = join(stack_dir.name, 'pages.npy')
+        stack = open_page_stack(stack_path)
+
+        # The reference features are computed once, before any page is scanned
+        session = make_session()
+
+        if args.workers > 1:
+            # Workers are forked so they inherit the options and the session,
+            # whose detector & FLANN indexes can't be pickled
+            executor = ProcessPoolExecutor(
+                max_workers=args.workers,
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=init_worker, 
+                initargs=(session, stack_path)
+            )
+
+        env = Environment(loader=FileSystemLoader(PATH_TEMPLATES))
+        template = env.get_template( "cat_ACT_Official.json" )
+    except BaseException:
+        args = None
+        raise
+
+    return args
+
+
+def run_pipeline(pdf: Union[str, bytes], test_code: str, 
+                 options: Union[dict, argparse.Namespace]=None) -> dict:
+    """
+    Runs the full pipeline on a single scoring key pdf in this process, 
+    e.g. in a long running service. The references, session, and workers
+    are set up by the first call and reused by later calls with the same
+    options, see configure().
+
+    Parameters
+    ----------
+    pdf : str or bytes
+        path/to/the/scoring_key.pdf, or the bytes of the pdf
+
+    test_code : str
+        The test code in yyyymm format
+
+    options : dict or argparse.Namespace
+        The options by CLI argument name, e.g. {'workers': 2, 
+        'output_dir': None}. With output_dir None, no json file is written.
+
+    Returns
+    -------
+    dict
+        The categories of each question of each section found, see 
+        category_map()
+    """
+    configure(options)
+    category_marks = process_pdf(pdf, test_code, executor)
+
+    return category_map(category_marks)
+
+
+def main() -> None:
+    """
+    The CLI: processes a single pdf, or a batch of pdfs, and writes their
+    category json files.
+    """
+    global show_markers
+
+    ap = build_parser()
+    options = ap.parse_args()
+
+    if options.build_refs:
+        build_references(PATH_REF, PATH_REF_RASTERS)
+        sys.exit()
 
+    if options.batch is None and (options.test_code is None or options.pdf_path is None):
+        ap.error("either --batch, or both --test_code and --pdf_path are required")
+
+    show_markers = options.batch is None and options.workers == 1
+
+    try:
+        configure(options)
+    except ValueError as e:
+        ap.error(str(e))
+
+    if options.batch is not None:
+        jobs = read_batch(options.batch)
+        failed = []
+
+        for test_code, pdf_path in jobs:
+            try:
+                process_pdf(pdf_path, test_code, executor)
+            except Exception as e:
+                # A bad pdf shouldn't abort the rest of the batch
+                print(f"Failed to process {pdf_path}: {e!r}")
+                failed.append(pdf_path)
+
+        print(f"\nProcessed {len(jobs) - len(failed)} of {len(jobs)} pdfs.")
+        for pdf_path in failed:
+            print(f"Failed: {pdf_path}")
+
+        sys.exit(1 if failed else 0)
+
+    process_pdf(options.pdf_path, options.test_code, executor)
 
-    # with pd.option_context('display.max_rows', None):
-    #     print(df)
 
-    for marks in sk.category_marks.values():
-        for m in marks:
-            # print(code, m.row, m.column, m.box)
-            df.loc[m.row, m.column] = True
-    
-    
-    with pd.option_context('display.max_rows', None): 
-        label = {'e':'English', 'm':'Math', 'r':'Reading', 's':'Science'}
-        print(label[code])
-        print(df, '\n\n') 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+import os, sys
+import cv2 as cv
+import unittest
+import numpy as np
+from os.path import abspath, join
+
+sys.path.append('../classes')
+from dewarpSession import DewarpSession
+from featureCache import FeatureCache
+from dewarper import Dewarper
+from scoreKey import Box
+
+PATH = "./test_files"
+PATH_HOMO = abspath( join(PATH, "homography.png") )
+PATH_ROT = abspath( join(PATH, "homography_rotated.png") )
+
+
+class TestCaseDewarpSession(unittest.TestCase):
+	def setUp(self):
+		self.ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+		self.img = cv.imread(PATH_ROT, cv.IMREAD_GRAYSCALE)
+
+
+	def tearDown(self):
+		pass
+
+
+	def test_instantiation(self):
+		ds = DewarpSession()
+		self.assertIsInstance(ds, DewarpSession)
+		self.assertIsInstance(ds.cache, FeatureCache)
+		self.assertIsInstance(ds.sifter, cv.SIFT)
+		self.assertEqual(ds.references, {})
+		self.assertIsNone(ds.dewarper)
+
+		with self.subTest("References & options"):
+			ds = DewarpSession({'a': PATH_HOMO, 'b': self.ref}, detector='orb', grayscale=True)
+			self.assertEqual(set(ds.references), {'a', 'b'})
+			self.assertIsInstance(ds.sifter, cv.ORB)
+			self.assertEqual(ds.options['detector'], 'orb')
+
+
+	def test_method_add_reference(self):
+		ds = DewarpSession()
+		d = ds.add_reference(1, self.ref)
+
+		self.assertIs(ds.references[1], d)
+		self.assertIs(d.sifter, ds.sifter)
+		self.assertIs(d.fanner, ds.fanner)
+		self.assertEqual(len(d.kpd_ref.kp), 124)
+		self.assertEqual(len(ds.cache.features), 1)
+		self.assertEqual(len(ds.cache.indexes), 1)
+
+		with self.subTest("Masked"):
+			mask = d.mask_from_boxes([Box(20, 20, 60, 50)], margin=5)
+			d = ds.add_reference(1, self.ref, ref_mask=mask)
+			self.assertLess(len(d.kpd_ref.kp), 124)
+			self.assertIs(d.ref_mask, mask)
+			self.assertEqual(len(ds.cache.features), 2)
+
+
+	def test_method_get_dewarper(self):
+		ds = DewarpSession({'h': self.ref})
+		d = ds.get_dewarper('h', self.img)
+
+		self.assertIsNot(d, ds.references['h'])
+		self.assertIs(d.img, self.img)
+		self.assertIs(d.kpd_ref, ds.references['h'].kpd_ref)
+		self.assertIsNone(ds.references['h'].img)
+
+		with self.subTest("Features"):
+			c = ds.classify(self.img)
+			d = ds.get_dewarper('h', self.img, features=c.features)
+			self.assertIs(d.kpd_img, c.features)
+			dewarped = d.dewarp()
+			self.assertIs(d.kpd_img, c.features)
+			similarity = cv.matchTemplate(dewarped, self.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.99)
+
+			# The image keypoints of a masked image are detected again
+			ds.references['h'].img_mask = np.full_like(self.img, 255)
+			d = ds.get_dewarper('h', self.img, features=c.features)
+			self.assertIsNone(d.kpd_img.kp)
+			ds.references['h'].img_mask = None
+
+		with self.assertRaises(KeyError):
+			ds.get_dewarper('x')
+
+
+	def test_method_dewarp(self):
+		ds = DewarpSession({'h': self.ref}, grayscale=True)
+		ref_kpd = ds.references['h'].kpd_ref
+
+		for i in range(3):
+			dewarped = ds.dewarp(self.img, 'h')
+			self.assertEqual(dewarped.shape, self.ref.shape)
+			similarity = cv.matchTemplate(dewarped, self.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.99)
+
+		# The reference features were computed once, and not recomputed
+		self.assertIs(ds.dewarper.kpd_ref, ref_kpd)
+		self.assertIsNone(ds.references['h'].transformation_matrix)
+
+		with self.subTest("Regions"):
+			regions = ds.dewarp(PATH_ROT, 'h', regions=[Box(10, 20, 50, 40)])
+			self.assertEqual(regions[0].shape, (40, 50))
+
+		with self.subTest("Seed"):
+			ds = DewarpSession({'h': self.ref}, shared_index=False, grayscale=True)
+			ds.dewarp(self.img, 'h')
+			M = ds.dewarper.transformation_matrix
+			ds.dewarp(self.img, 'h', seed=M)
+			self.assertEqual(ds.dewarper.homography_source, 'seed')
+			self.assertIsNone(ds.references['h'].seed)
+
+
+	def test_method_classify(self):
+		rng = np.random.default_rng(0)
+		noise = cv.GaussianBlur(rng.integers(0, 256, self.ref.shape, dtype='uint8'), (5, 5), 0)
+		ds = DewarpSession({'h': self.ref, 'n': noise}, grayscale=True)
+
+		c = ds.classify(self.img)
+		self.assertIsInstance(c, DewarpSession.Classification)
+		self.assertEqual(c.name, 'h')
+		self.assertEqual(set(c.votes), {'h', 'n'})
+		self.assertGreaterEqual(c.votes['h'], ds.MIN_VOTES)
+		self.assertGreaterEqual(c.votes['h'], ds.VOTE_MARGIN * c.votes['n'])
+		self.assertEqual(ds.classify(noise).name, 'n')
+
+		with self.subTest("Unidentified"):
+			blank = np.full_like(self.ref, 255)
+			c = ds.classify(blank)
+			self.assertIsNone(c.name)
+			self.assertEqual(c.votes, {'h': 0, 'n': 0})
+			self.assertIsNone(ds.classify(self.img, names=['n']).name)
+
+		with self.subTest("Path & ORB"):
+			ds = DewarpSession({'h': self.ref, 'n': noise}, detector='orb', grayscale=True)
+			self.assertEqual(ds.classify(PATH_ROT).name, 'h')
+
+		with self.subTest("Masked reference"):
+			ds = DewarpSession({'n': noise}, grayscale=True)
+			mask = ds.references['n'].mask_from_boxes([Box(20, 20, 60, 50)], margin=5)
+			d = ds.add_reference('h', self.ref, ref_mask=mask)
+			voter = ds.voters['h']
+			self.assertIsNot(voter, d)
+			self.assertIsNone(voter.ref_mask)
+			self.assertGreater(len(voter.kpd_ref.kp), len(d.kpd_ref.kp))
+			self.assertEqual(ds.classify(self.img).name, 'h')
+
+		with self.subTest("AKAZE"):
+			if not hasattr(cv, 'AKAZE_create'):
+				self.skipTest("This OpenCV build has no AKAZE")
+			ds = DewarpSession({'h': self.ref, 'n': noise}, detector='akaze', grayscale=True)
+			c = ds.classify(self.img)
+			self.assertEqual(c.name, 'h')
+			self.assertEqual(ds.classify(noise).name, 'n')
+			self.assertIsNone(ds.classify(blank).name)
+
+
+### END TEST METHODS ##############################################################
+
+
+
+
+def suite():
+	suite = unittest.TestSuite()
+	suite.addTest(TestCaseDewarpSession('test_instantiation'))
+	suite.addTest(TestCaseDewarpSession('test_method_add_reference'))
+	suite.addTest(TestCaseDewarpSession('test_method_get_dewarper'))
+	suite.addTest(TestCaseDewarpSession('test_method_dewarp'))
+	suite.addTest(TestCaseDewarpSession('test_method_classify'))
+
+	return suite
+
+
+if __name__ == '__main__':
+	runner = unittest.TextTestRunner()
+	runner.run(suite())
@@ -6,10 +6,13 @@ from os.path import abspath, join
 
 sys.path.append('../classes')
 from dewarper import Dewarper
+from scoreKey import Box
 
 PATH = "./test_files"
 PATH_HOMO = abspath( join(PATH, "homography.png") )
 PATH_ROT = abspath( join(PATH, "homography_rotated.png") )
+PATH_SKM = abspath("../images/skm.png")
+PATH_SKS = abspath("../images/sks.png")
 # print(PATH_HOMO)
 
 FLAG_SHOW_DISPLAY_METHODS = False
@@ -138,6 +141,41 @@ class TestCaseDewarper(unittest.TestCase):
 
 		self.assertEqual(len(dw.good_matches), 120)
 
+		with self.subTest("Match arrays"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT)
+			dw.sift('ref')
+			dw.sift('img')
+			dw.fann()
+			ref_idx, img_idx, dist = dw.knn
+			self.assertEqual(ref_idx.shape, (124, 2))
+			self.assertEqual(dist[3, 1], dw.matches[3][1].distance)
+			self.assertEqual(img_idx[5, 0], dw.matches[5][0].trainIdx)
+
+			dw.filter_matches()
+			expected = [ r for r, i in dw.matches if r.distance < 0.7 * i.distance ]
+			self.assertEqual(len(dw.good[0]), len(expected))
+			self.assertEqual(
+				[ (m.queryIdx, m.trainIdx) for m in dw.good_matches ],
+				[ (m.queryIdx, m.trainIdx) for m in expected ]
+			)
+
+		with self.subTest("Shared index"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, shared_index=True)
+			dw.sift('ref')
+			dw.sift('img')
+			dw.fann()
+			self.assertIsNone(dw._matches)
+			self.assertEqual(dw.knn[0].shape, (130, 2))
+			self.assertEqual(dw.matches[7][1].queryIdx, dw.knn[0][7, 1])
+			self.assertEqual(dw.matches[7][1].trainIdx, 7)
+
+		with self.subTest("Assigned matches"):
+			dw.filter_matches()
+			dw.good_matches = dw.good_matches[0:10]
+			self.assertEqual(dw.good[0].shape, (10,))
+			dw.get_homography()
+			self.assertEqual(len(dw.homo_mask), 10)
+
 
 	def test_method_get_homography(self):
 		dw = Dewarper(PATH_HOMO, PATH_HOMO)
@@ -204,6 +242,14 @@ class TestCaseDewarper(unittest.TestCase):
 			self.assertEqual(len(dw.ref.shape), len(dewarped.shape))
 			self.assertEqual(dw.ref.shape, dewarped.shape[0:2])
 
+		with self.subTest("Dewarped image is written into a preallocated array"):
+			stack = np.zeros((2, *dw.og.shape), dtype='uint8')
+			dewarped = dw.dewarp_image(dst=stack[1])
+			self.assertTrue(np.shares_memory(dw.dewarped, stack))
+			self.assertEqual(stack[0].max(), 0)
+			similarity = cv.matchTemplate(dewarped, dw.ref, 3).round(3)
+			self.assertEqual(similarity[0][0], 1.0)
+
 
 	def test_method_dewarp(self):
 		with self.subTest("Basic Homography - Identical Images"):
@@ -263,6 +309,341 @@ class TestCaseDewarper(unittest.TestCase):
 			self.assertEqual(dw.ref.shape, dewarped.shape[0:2])	
 
 
+		with self.subTest("Reused Across Loaded Images"):
+			for grayscale in (False, True):
+				dw = Dewarper(PATH_HOMO, PATH_HOMO, grayscale=grayscale)
+				dw.dewarp()
+				self.assertTrue(np.allclose(dw.transformation_matrix, np.eye(3), atol=1e-2))
+
+				# The keypoints of the previous image aren't reused
+				dw.load(PATH_ROT, 'img')
+				self.assertIsNone(dw.kpd_img.kp)
+				dw.dewarp()
+				self.assertFalse(np.allclose(dw.transformation_matrix, np.eye(3), atol=1e-2))
+				similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+				self.assertGreater(similarity[0][0], 0.99)
+
+
+	def test_grayscale(self):
+		with self.subTest("Args are string paths"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, grayscale=True)
+			self.assertEqual(len(dw.og.shape), 2)
+			self.assertIs(dw.og, dw.img)
+
+			dw.dewarp()
+			self.assertIs(dw.dewarped, dw.dewarped_gray)
+			self.assertEqual(dw.ref.shape, dw.dewarped.shape)
+			similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.99)
+
+		with self.subTest("Grayscale images passed to dewarp"):
+			ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+			img = cv.imread(PATH_ROT, cv.IMREAD_GRAYSCALE)
+			dw = Dewarper(grayscale=True)
+			dewarped = dw.dewarp(ref, img)
+			self.assertEqual(dewarped.shape, ref.shape)
+			similarity = cv.matchTemplate(dewarped, ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.99)
+
+		with self.subTest("Color image is converted once"):
+			dw = Dewarper(grayscale=True)
+			dw.load(PATH_ROT, 'img')
+			self.assertEqual(len(dw.og.shape), 2)
+			self.assertIs(dw.og, dw.img)
+
+
+	def test_method_dewarp_regions(self):
+		dw = Dewarper(PATH_HOMO, PATH_ROT)
+		dw.dewarp()
+		full = dw.dewarped
+
+		boxes = [Box(10, 20, 50, 40), Box(0, 0, 30, 30), Box(60, 5, 20, 70)]
+		regions = dw.dewarp_regions(boxes)
+
+		self.assertIsInstance(regions, list)
+		self.assertIs(dw.dewarped_regions, regions)
+		self.assertEqual(len(regions), 3)
+
+		for region, b in zip(regions, boxes):
+			self.assertEqual(region.shape[0:2], (b.h, b.w))
+			crop = full[b.y:b.y+b.h, b.x:b.x+b.w].astype('int')
+			diff = np.abs(region.astype('int') - crop)
+			self.assertLessEqual(diff.max(), 1)
+
+		with self.subTest("Regions passed to dewarp"):
+			dw = Dewarper(grayscale=True)
+			regions = dw.dewarp(PATH_HOMO, PATH_ROT, regions=boxes)
+			self.assertEqual(len(regions), 3)
+			self.assertEqual(regions[0].shape, (40, 50))
+			self.assertIsNone(dw.dewarped)
+
+
+	def test_method_mask_from_boxes(self):
+		dw = Dewarper(PATH_HOMO)
+		mask = dw.mask_from_boxes([Box(20, 20, 60, 50)], margin=3, header=10)
+
+		self.assertEqual(mask.shape, dw.ref.shape)
+		self.assertEqual(mask.dtype, np.uint8)
+		self.assertEqual(set(np.unique(mask)), {0, 255})
+		self.assertEqual(mask[20, 50], 255)		# top border
+		self.assertEqual(mask[28, 50], 255)		# header
+		self.assertEqual(mask[45, 50], 0)		# box interior
+		self.assertEqual(mask[45, 80], 255)		# right border
+		self.assertEqual(mask[5, 5], 0)			# outside the box
+
+
+	def test_method_detect(self):
+		dw = Dewarper(PATH_HOMO)
+		kp, des = dw.detect(dw.ref)
+		self.assertEqual(len(kp), 124)
+
+		with self.subTest("Capped to the strongest keypoints"):
+			dw.max_keypoints = 50
+			kp_50, des_50 = dw.detect(dw.ref)
+			self.assertEqual(len(kp_50), 50)
+			self.assertEqual(des_50.shape, (50, 128))
+			# No dropped keypoint is stronger than a kept one
+			weakest = min(k.response for k in kp_50)
+			self.assertLessEqual(sum(k.response > weakest for k in kp), 50)
+
+		with self.subTest("Masked"):
+			mask = dw.mask_from_boxes([Box(20, 20, 60, 50)], margin=5)
+			dw = Dewarper(PATH_HOMO, ref_mask=mask)
+			dw.sift('ref')
+			self.assertLess(len(dw.kpd_ref.kp), 124)
+			for k in dw.kpd_ref.kp:
+				x, y = np.int32(k.pt)
+				self.assertEqual(mask[y, x], 255)
+
+
+	def test_detector(self):
+		with self.subTest("SIFT by default"):
+			dw = Dewarper()
+			self.assertEqual(dw.detector, 'sift')
+			self.assertIsInstance(dw.fanner, cv.FlannBasedMatcher)
+
+		with self.subTest("ORB"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, detector='orb', shared_index=True)
+			self.assertIsInstance(dw.sifter, cv.ORB)
+			self.assertIsInstance(dw.fanner, cv.BFMatcher)
+			self.assertFalse(dw.shared_index)
+
+			dw.dewarp()
+			self.assertEqual(dw.kpd_ref.des.dtype, np.uint8)
+			self.assertGreater(len(dw.good_matches), 20)
+			similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.9)
+
+		with self.subTest("AKAZE"):
+			if not hasattr(cv, 'AKAZE_create'):
+				self.skipTest("This OpenCV build has no AKAZE")
+			dw = Dewarper(PATH_HOMO, PATH_ROT, detector='akaze')
+			dw.dewarp()
+			self.assertTrue(all(len(m) == 2 for m in dw.matches))
+			similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.9)
+
+		with self.assertRaises(ValueError):
+			Dewarper(detector='surf')
+
+
+	def test_pyramid(self):
+		dw = Dewarper(PATH_HOMO, PATH_ROT, pyramid_scale=0.75)
+		dw.dewarp()
+		similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+		self.assertGreater(similarity[0][0], 0.99)
+
+		# Keypoints are in full resolution coordinates
+		self.assertGreater(max(k.pt[0] for k in dw.kpd_ref.kp), 0.75 * dw.ref.shape[1])
+
+		with self.subTest("Method refine_homography"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT)
+			dw.dewarp()
+			M = dw.transformation_matrix
+
+			# Shift the estimate by 2 px, then recover it
+			T = np.array([ [1, 0, 2], [0, 1, -2], [0, 0, 1] ], dtype='float64')
+			dw.transformation_matrix = T @ M
+			dw.refine_homography()
+
+			h, w = dw.ref.shape
+			corners = np.float32([ [0,0], [w,0], [w,h], [0,h] ]).reshape(-1,1,2)
+			error = cv.perspectiveTransform(corners, dw.transformation_matrix) - \
+					cv.perspectiveTransform(corners, M)
+			self.assertLess(np.abs(error).max(), 1)
+
+		with self.subTest("No homography"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT)
+			dw.refine_homography()
+			self.assertIsNone(dw.transformation_matrix)
+
+
+	def test_method_is_aligned(self):
+		ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+
+		with self.subTest("Identical"):
+			dw = Dewarper(ref, ref.copy(), grayscale=True)
+			self.assertTrue(dw.is_aligned())
+			self.assertEqual(len(dw.alignment), 2)
+			self.assertEqual(dw.alignment[0][0:2], (0, 0))
+
+		with self.subTest("Boxes"):
+			dw = Dewarper(ref, ref.copy(), grayscale=True)
+			self.assertTrue(dw.is_aligned([Box(100, 100, 300, 250)], header=30))
+			self.assertEqual(len(dw.alignment), 2)
+
+		with self.subTest("Shifted"):
+			dw = Dewarper(ref, np.roll(ref, 2, axis=1), grayscale=True)
+			self.assertFalse(dw.is_aligned())
+			self.assertEqual(dw.alignment[0][0:2], (2, 0))
+
+		with self.subTest("Rotated"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, grayscale=True)
+			self.assertFalse(dw.is_aligned())
+
+		with self.subTest("Blank"):
+			blank = np.full_like(ref, 255)
+			dw = Dewarper(blank, blank.copy(), grayscale=True)
+			self.assertFalse(dw.is_aligned())
+			self.assertEqual(dw.alignment, [])
+
+
+	def test_seed(self):
+		dw = Dewarper(PATH_HOMO, PATH_ROT)
+		dw.dewarp()
+		M = dw.transformation_matrix
+		self.assertEqual(dw.homography_source, 'ransac')
+
+		h, w = dw.ref.shape
+		corners = np.float32([ [0,0], [w,0], [w,h], [0,h] ]).reshape(-1,1,2)
+
+		with self.subTest("Method is_aligned with a transform"):
+			self.assertTrue(dw.is_aligned(M=M))
+			self.assertFalse(dw.is_aligned(M=np.eye(3)))
+
+		with self.subTest("Seed is used as is"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, seed=M)
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'seed')
+			self.assertIs(dw.transformation_matrix, M)
+			self.assertIsNone(dw.kpd_img.kp)
+
+		with self.subTest("Seed selects the inliers"):
+			T = np.array([ [1, 0, 3], [0, 1, -2], [0, 0, 1] ], dtype='float64')
+			dw = Dewarper(PATH_HOMO, PATH_ROT, seed=T @ M)
+			dw.SEED_INLIER_RATIO = 0.3
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'seed_refined')
+			self.assertEqual(sum(dw.homo_mask), 10)
+			error = cv.perspectiveTransform(corners, dw.transformation_matrix) - \
+					cv.perspectiveTransform(corners, M)
+			self.assertLess(np.abs(error).max(), 1)
+
+		with self.subTest("Seed is rejected"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, seed=np.eye(3))
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'ransac')
+			np.testing.assert_array_equal(dw.transformation_matrix, M)
+
+
+	def test_homography_quality(self):
+		dw = Dewarper(PATH_HOMO, PATH_ROT)
+		dw.dewarp()
+		q = dw.quality
+		self.assertIsInstance(q, Dewarper.Quality)
+		self.assertEqual(q.matches, 26)
+		self.assertEqual(q.inliers, sum(dw.homo_mask))
+		self.assertAlmostEqual(q.inlier_ratio, q.inliers / 26)
+		self.assertLess(q.reprojection_error, 1)
+		self.assertAlmostEqual(q.determinant, 1, places=1)
+		self.assertAlmostEqual(q.condition, 1, places=1)
+
+		# The test image has fewer inliers than a page
+		self.assertFalse(dw.is_acceptable())
+		dw.MIN_INLIERS = 8
+		self.assertTrue(dw.is_acceptable())
+
+		with self.subTest("No homography"):
+			ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+			blank = np.full_like(ref, 255)
+			dw = Dewarper(ref, blank, grayscale=True)
+			dw.sift('ref')
+			dw.sift('img')
+			dw.fann()
+			dw.filter_matches()
+			dw.get_homography()
+			self.assertIsNone(dw.transformation_matrix)
+			self.assertIsNone(dw.quality)
+			self.assertFalse(dw.is_acceptable())
+
+			with self.assertRaises(ValueError):
+				dw.dewarp()
+
+		with self.subTest("Wrong reference"):
+			# The science page matched against the math page, which shares
+			# its layout: the area & aspect ratio are kept, but few inliers
+			ref = cv.imread(PATH_SKM, cv.IMREAD_GRAYSCALE)
+			img = cv.imread(PATH_SKS, cv.IMREAD_GRAYSCALE)
+			R = cv.getRotationMatrix2D((img.shape[1] / 2, img.shape[0] / 2), 1.0, 1)
+			img = cv.warpAffine(img, R, img.shape[::-1], borderValue=255)
+
+			dw = Dewarper(ref, img, grayscale=True)
+			dw.dewarp()
+			q = dw.quality
+			self.assertLess(q.inlier_ratio, dw.MIN_INLIER_RATIO)
+			self.assertFalse(dw.is_acceptable())
+
+			dw = Dewarper(ref, img, grayscale=True, fallbacks=('ratio', 'identity'))
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'identity')
+
+
+	def test_method_fall_back(self):
+		ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+		blank = np.full_like(ref, 255)
+
+		with self.subTest("Identity"):
+			dw = Dewarper(ref, blank, grayscale=True, fallbacks=('ratio', 'orb', 'identity'))
+			dewarped = dw.dewarp()
+			self.assertEqual(dw.homography_source, 'identity')
+			np.testing.assert_array_equal(dw.transformation_matrix, np.eye(3))
+			np.testing.assert_array_equal(dewarped, blank)
+
+		with self.subTest("Relaxed ratio"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, fallbacks=('ratio',))
+			dw.MIN_INLIERS = 15
+			dw.MIN_INLIER_RATIO = 0.1  # The test image has fewer inliers than a page
+			dw.RELAXED_MATCH_RATIO = 0.9
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'ratio')
+			self.assertGreaterEqual(dw.quality.inliers, 15)
+			self.assertEqual(len(dw.good_matches), dw.quality.matches)
+			similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.99)
+
+		with self.subTest("Alternate detector"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, fallbacks=('orb',))
+			dw.MATCH_RATIO = 0.2  # Too strict for SIFT to find a homography
+			dw.MIN_INLIERS = 12
+			dw.MIN_INLIER_RATIO = 0.1
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'orb')
+			self.assertEqual(dw.kpd_ref.des.dtype, np.uint8)
+			self.assertGreaterEqual(dw.quality.inliers, 12)
+			similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+			self.assertGreater(similarity[0][0], 0.9)
+
+		with self.subTest("None succeed"):
+			dw = Dewarper(PATH_HOMO, PATH_ROT, fallbacks=('ratio',))
+			dw.MIN_INLIERS = 1000
+			dw.dewarp()
+			self.assertEqual(dw.homography_source, 'ransac')
+			self.assertIsNotNone(dw.transformation_matrix)
+
+		with self.assertRaises(ValueError):
+			Dewarper(fallbacks=('skip',))
+
+
 ### END TEST METHODS ##############################################################
 
 
@@ -281,6 +662,16 @@ def suite():
 	suite.addTest(TestCaseDewarper('test_method_show_homography'))
 	suite.addTest(TestCaseDewarper('test_method_dewarp_image'))
 	suite.addTest(TestCaseDewarper('test_method_dewarp'))
+	suite.addTest(TestCaseDewarper('test_grayscale'))
+	suite.addTest(TestCaseDewarper('test_method_dewarp_regions'))
+	suite.addTest(TestCaseDewarper('test_method_mask_from_boxes'))
+	suite.addTest(TestCaseDewarper('test_method_detect'))
+	suite.addTest(TestCaseDewarper('test_detector'))
+	suite.addTest(TestCaseDewarper('test_pyramid'))
+	suite.addTest(TestCaseDewarper('test_method_is_aligned'))
+	suite.addTest(TestCaseDewarper('test_seed'))
+	suite.addTest(TestCaseDewarper('test_homography_quality'))
+	suite.addTest(TestCaseDewarper('test_method_fall_back'))
 
 	return suite
 
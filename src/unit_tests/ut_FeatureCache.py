@@ -0,0 +1,167 @@
+import os, sys
+import cv2 as cv
+import unittest
+import tempfile
+import numpy as np
+from os.path import abspath, join
+
+sys.path.append('../classes')
+from featureCache import FeatureCache
+from dewarper import Dewarper
+
+PATH = "./test_files"
+PATH_HOMO = abspath( join(PATH, "homography.png") )
+PATH_ROT = abspath( join(PATH, "homography_rotated.png") )
+
+
+class TestCaseFeatureCache(unittest.TestCase):
+	def setUp(self):
+		self.tmp = tempfile.TemporaryDirectory()
+		self.ref = cv.imread(PATH_HOMO, cv.IMREAD_GRAYSCALE)
+		self.params = dict(nfeatures=0, sigma=1.6)
+
+
+	def tearDown(self):
+		self.tmp.cleanup()
+
+
+	def test_instantiation(self):
+		fc = FeatureCache()
+		self.assertIsInstance(fc, FeatureCache)
+		self.assertIsNone(fc.directory)
+
+		directory = join(self.tmp.name, 'cache')
+		fc = FeatureCache(directory)
+		self.assertTrue(os.path.isdir(directory))
+
+
+	def test_method_key(self):
+		fc = FeatureCache()
+		k1 = fc.key(self.ref, self.params)
+		k2 = fc.key(self.ref.copy(), dict(sigma=1.6, nfeatures=0))
+		self.assertIsInstance(k1, str)
+		self.assertEqual(k1, k2)
+
+		with self.subTest("Different parameters"):
+			k3 = fc.key(self.ref, dict(nfeatures=500, sigma=1.6))
+			self.assertNotEqual(k1, k3)
+
+		with self.subTest("Different image"):
+			rot = cv.imread(PATH_ROT, cv.IMREAD_GRAYSCALE)
+			self.assertNotEqual(k1, fc.key(rot, self.params))
+
+		with self.subTest("Masked"):
+			mask = np.zeros_like(self.ref)
+			k4 = fc.key(self.ref, self.params, mask)
+			self.assertNotEqual(k1, k4)
+			mask[0:10, 0:10] = 255
+			self.assertNotEqual(k4, fc.key(self.ref, self.params, mask))
+
+
+	def test_method_get_put(self):
+		sifter = cv.SIFT_create()
+		kp, des = sifter.detectAndCompute(self.ref, None)
+
+		fc = FeatureCache(self.tmp.name)
+		key = fc.key(self.ref, self.params)
+		self.assertIsNone(fc.get(key))
+
+		fc.put(key, kp, des)
+		self.assertTrue(os.path.isfile(fc.path(key)))
+
+		with self.subTest("Memory"):
+			kp_m, des_m = fc.get(key)
+			self.assertEqual(len(kp_m), len(kp))
+			self.assertIs(des_m, des)
+
+		with self.subTest("Disk"):
+			kp_d, des_d = FeatureCache(self.tmp.name).get(key)
+			self.assertEqual(len(kp_d), 124)
+			self.assertIsInstance(kp_d[0], cv.KeyPoint)
+			np.testing.assert_array_equal(des_d, des)
+			for a, b in zip(kp, kp_d):
+				self.assertEqual(a.pt, b.pt)
+				self.assertEqual(a.octave, b.octave)
+				self.assertAlmostEqual(a.angle, b.angle, places=3)
+
+
+	def test_dewarper_cache(self):
+		fc = FeatureCache(self.tmp.name)
+
+		dw = Dewarper(PATH_HOMO, PATH_ROT, cache=fc)
+		dw.sift('ref')
+		self.assertEqual(len(fc.features), 1)
+		self.assertEqual(len(dw.kpd_ref.kp), 124)
+
+		# A second Dewarper on the same reference reads from the cache
+		dw2 = Dewarper(PATH_HOMO, PATH_ROT, cache=FeatureCache(self.tmp.name))
+		dw2.sift('ref')
+		np.testing.assert_array_equal(dw2.kpd_ref.des, dw.kpd_ref.des)
+
+		dewarped = dw2.dewarp()
+		similarity = cv.matchTemplate(dw2.dewarped_gray, dw2.ref, 3).round(3)
+		self.assertGreater(similarity[0][0], 0.99)
+
+
+	def test_method_get_index(self):
+		sifter = cv.SIFT_create()
+		kp, des = sifter.detectAndCompute(self.ref, None)
+		index_params = dict(algorithm=1, trees=5)
+
+		fc = FeatureCache(self.tmp.name)
+		key = fc.key(self.ref, self.params)
+		fc.put(key, kp, des)
+
+		index = fc.get_index(key, des, index_params)
+		self.assertIs(fc.get_index(key, des, index_params), index)
+		self.assertEqual(len(fc.indexes), 1)
+
+		with self.subTest("Loaded from disk"):
+			fc2 = FeatureCache(self.tmp.name)
+			kp2, des2 = fc2.get(key)
+			index2 = fc2.get_index(key, des2, index_params)
+			idx, dist = index2.knnSearch(des, 2, params=dict(checks=50))
+			self.assertEqual(idx.shape, (124, 2))
+			# Every descriptor's nearest neighbor is itself (or an identical twin)
+			np.testing.assert_array_equal(dist[:, 0], 0)
+
+
+	def test_dewarper_shared_index(self):
+		fc = FeatureCache()
+		dw = Dewarper(PATH_HOMO, PATH_ROT, cache=fc, shared_index=True)
+		dw.dewarp()
+		self.assertEqual(len(fc.indexes), 1)
+		self.assertIsInstance(dw.matches[0][0], cv.DMatch)
+		self.assertLess(dw.matches[0][0].queryIdx, len(dw.kpd_ref.kp))
+		self.assertLess(dw.matches[0][0].trainIdx, len(dw.kpd_img.kp))
+		similarity = cv.matchTemplate(dw.dewarped_gray, dw.ref, 3).round(3)
+		self.assertGreater(similarity[0][0], 0.99)
+
+		# The index is reused, not rebuilt, by the next Dewarper
+		index = list(fc.indexes.values())[0]
+		dw = Dewarper(PATH_HOMO, PATH_HOMO, cache=fc, shared_index=True)
+		dw.dewarp()
+		self.assertIs(list(fc.indexes.values())[0], index)
+		self.assertEqual(len(dw.good_matches), 120)
+
+
+### END TEST METHODS ##############################################################
+
+
+
+
+def suite():
+	suite = unittest.TestSuite()
+	suite.addTest(TestCaseFeatureCache('test_instantiation'))
+	suite.addTest(TestCaseFeatureCache('test_method_key'))
+	suite.addTest(TestCaseFeatureCache('test_method_get_put'))
+	suite.addTest(TestCaseFeatureCache('test_dewarper_cache'))
+	suite.addTest(TestCaseFeatureCache('test_method_get_index'))
+	suite.addTest(TestCaseFeatureCache('test_dewarper_shared_index'))
+
+	return suite
+
+
+if __name__ == '__main__':
+	runner = unittest.TextTestRunner()
+	runner.run(suite())
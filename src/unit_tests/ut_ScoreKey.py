@@ -6,6 +6,7 @@ from PIL import Image
 sys.path.append('../classes')
 sys.path.append('./test_files')
 from scoreKey import Box, Marker, ScoreKey, Column, Row
+from dewarper import Dewarper
 
 
 class TestCaseBox(unittest.TestCase):
@@ -69,6 +70,25 @@ class TestCaseMarker(unittest.TestCase):
 
 class TestCaseScoreKey(unittest.TestCase):
 
+    def dewarp_rotated(self, path: str, codes: list, angle: float) -> list:
+        # Rotates a page slightly, then dewarps the boxes of each section
+        # back, returning the ScoreKeys of the reference & dewarped boxes
+        page = Image.open(path).convert('L').resize((850,1100))
+        # Moved up 1 px, where rasterizing the pdf puts the ruling lines
+        page = np.roll(np.asarray(page, dtype='uint8'), -1, axis=0)
+        M = cv2.getRotationMatrix2D((425, 550), angle, 1.0)
+        rotated = cv2.warpAffine(page, M, (850, 1100), borderValue=255)
+        dewarper = Dewarper(page, rotated, grayscale=True)
+
+        pairs = []
+        for code in codes:
+            sk = ScoreKey(code, grayscale=True)
+            sk.load_images(dewarper.dewarp(regions=sk.tables))
+            pairs.append((ScoreKey(code, page, grayscale=True), sk))
+
+        return pairs
+
+
     def setUp(self):
         page_image = Image.open("../images/ske.png")
         page_image = page_image.convert('RGB')
@@ -110,6 +130,15 @@ class TestCaseScoreKey(unittest.TestCase):
                 self.assertEqual(len(image.shape), 3)
                 self.assertIsInstance(image[0][0][0], np.uint8)
 
+        with self.subTest("Grayscale page in grayscale mode"):
+            gray = cv2.cvtColor(self.page_image, cv2.COLOR_RGB2GRAY)
+            sk = ScoreKey('e', gray, grayscale=True)
+            self.assertTrue(sk.grayscale)
+
+            for image, box in zip(sk.images, sk.tables):
+                self.assertEqual(image.shape, (box.h, box.w))
+                self.assertTrue(np.shares_memory(image, gray))
+
         with self.assertRaises(TypeError):
             ScoreKey('e', 12345)
 
@@ -140,9 +169,41 @@ class TestCaseScoreKey(unittest.TestCase):
         with self.assertRaises(TypeError):
             sk.load_page(123)
 
+        # The boxes of a BGR page are views into the page, not copies
+        self.assertTrue(np.shares_memory(sk.images[0], self.page_image))
+
+        # The boxes of a grayscale page are converted to BGR
+        gray = cv2.cvtColor(self.page_image, cv2.COLOR_RGB2GRAY)
+        sk.load_page(gray)
+        self.assertEqual(sk.images[0].shape, (h, w, 3))
+        self.assertEqual(sk.images[1].shape, (sk.tables[1].h, sk.tables[1].w, 3))
+
         pass
 
 
+    def method_load_images(self):
+        sk = ScoreKey('e', grayscale=True)
+        gray = cv2.cvtColor(self.page_image, cv2.COLOR_RGB2GRAY)
+        boxes = [gray[b.y:b.y+b.h, b.x:b.x+b.w] for b in sk.tables]
+
+        self.assertTrue(sk.load_images(boxes))
+        self.assertIs(sk.images[0], boxes[0])
+        self.assertIs(sk.images[1], boxes[1])
+
+        sk = ScoreKey('e')
+        sk.load_images(boxes)
+        self.assertEqual(len(sk.images[0].shape), 3)
+
+        with self.assertRaises(ValueError):
+            sk.load_images(boxes[:1])
+
+        with self.assertRaises(TypeError):
+            sk.load_images([boxes[1], boxes[0]])
+
+        with self.assertRaises(TypeError):
+            sk.load_images([123, boxes[1]])
+
+
     def method_get_contours(self):
         sk = self.scoreKey
         image = cv2.imread('test_files/good_line.png')
@@ -212,6 +273,202 @@ class TestCaseScoreKey(unittest.TestCase):
         self.assertEqual(h, 2)
 
 
+    def method_marker_mask(self):
+        sk = self.scoreKey
+        rects = np.array([
+            [70, 90, 24, 2],   # A marker line
+            [70, 90, 24, 12],  # Too tall
+            [70, 90, 10, 2],   # Too narrow
+            [70, 90, 40, 2],   # Too wide
+            [70, 50, 24, 2],   # Too high on the page
+            [20, 90, 24, 2],   # Too far left
+        ])
+
+        mask = sk.marker_mask(rects)
+        self.assertIsInstance(mask, np.ndarray)
+        self.assertEqual(mask.tolist(), [True, False, False, False, False, False])
+        self.assertEqual(sk.marker_mask(np.zeros((0, 4), dtype='int32')).shape, (0,))
+
+
+    def method_extract_marker_boxes(self):
+        sk = self.scoreKey
+        image = np.full((200, 200), 255, dtype='uint8')
+        cv2.rectangle(image, (70, 90), (93, 91), 0, -1)    # A marker line
+        cv2.rectangle(image, (70, 120), (93, 140), 0, -1)  # A square
+        cv2.rectangle(image, (10, 150), (33, 151), 0, -1)  # Outside the box
+        contours = sk.get_contours(image)
+
+        rects = sk.get_bounding_rects(contours)
+        self.assertEqual(rects.shape, (3, 4))
+
+        indexes, boxes = sk.extract_marker_boxes(contours)
+        self.assertEqual(len(indexes), 1)
+        self.assertEqual(boxes.tolist(), [[70, 90, 24, 2]])
+        self.assertEqual(cv2.boundingRect(contours[indexes[0]]), (70, 90, 24, 2))
+
+        markers = sk.extract_markers(contours)
+        self.assertIsInstance(markers, list)
+        self.assertIs(markers[0], contours[indexes[0]])
+        self.assertTrue(sk.filter_markers(markers[0]))
+
+        with self.subTest("Marker from precomputed box"):
+            m = Marker(markers[0], boxes[0])
+            self.assertIsInstance(m.box, Box)
+            self.assertIsInstance(m.box.x, int)
+            self.assertEqual((m.box.x, m.box.y, m.box.w, m.box.h), (70, 90, 24, 2))
+            self.assertIs(Marker(markers[0], m.box).box, m.box)
+
+        with self.subTest("No contours"):
+            indexes, boxes = sk.extract_marker_boxes(())
+            self.assertEqual(len(indexes), 0)
+            self.assertEqual(boxes.shape, (0, 4))
+
+
+    def method_get_components(self):
+        sk = self.scoreKey
+        image = np.full((200, 200), 255, dtype='uint8')
+        cv2.rectangle(image, (70, 90), (93, 91), 0, -1)    # A marker line
+        cv2.rectangle(image, (100, 110), (140, 150), 0, 6) # A hollow square
+        cv2.rectangle(image, (10, 150), (33, 151), 0, -1)  # Outside the box
+
+        stats = sk.get_components(image)
+        self.assertIsInstance(stats, np.ndarray)
+        self.assertEqual(stats.shape, (3, 5))
+        self.assertEqual(stats[0].tolist(), [70, 90, 24, 2, 48])
+
+        # The boxes are the bounding rects of the outer contours
+        rects = sk.get_bounding_rects(sk.get_contours(image))
+        self.assertEqual(len(rects), 4)  # The square's hole has a contour too
+        self.assertTrue(set(map(tuple, stats[:, :4].tolist())) < set(map(tuple, rects.tolist())))
+
+        with self.subTest("Markers"):
+            mask = sk.marker_mask(stats[:, :4])
+            self.assertEqual(mask.tolist(), [True, False, False])
+            m = Marker(None, stats[0, :4])
+            self.assertIsNone(m.contour)
+            self.assertEqual(m.box.area, 48)
+
+        with self.subTest("BGR image"):
+            bgr = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            np.testing.assert_array_equal(sk.get_components(bgr), stats)
+
+
+    def method_detect_grid(self):
+        sk = self.scoreKey
+        grid = sk.detect_grid(sk.images[0])
+        self.assertIsInstance(grid, ScoreKey.Grid)
+        self.assertEqual(grid.rows.shape, (38, 2))
+        self.assertEqual(grid.columns.shape, (4, 2))
+        self.assertEqual(len(grid.row_lookup), sk.images[0].shape[0])
+        self.assertEqual(len(grid.column_lookup), sk.images[0].shape[1])
+        self.assertEqual(grid.row_lookup[grid.rows[-1, 0]], 38)
+
+        with self.subTest("Locate markers"):
+            # Every question of the box has 1 marker, in a category column
+            rects = sk.get_bounding_rects(sk.get_contours(sk.images[0]))
+            rows, cols = sk.locate_markers(grid, rects[sk.marker_mask(rects)])
+            self.assertEqual(sorted(rows.tolist()), list(range(1, 39)))
+            self.assertTrue(np.isin(cols, [1, 2, 3]).all())
+
+        with self.subTest("First row"):
+            grid = sk.detect_grid(sk.images[1], first_row=39)
+            self.assertEqual(len(grid.rows), 37)
+            self.assertEqual(grid.row_lookup.max(), 75)
+
+        with self.subTest("Wrong section"):
+            with self.assertRaises(ValueError):
+                ScoreKey('m').detect_grid(sk.images[0])
+
+
+    def method_get_cells(self):
+        sk = self.scoreKey
+        self.assertEqual([c.shape for c in sk.cells], [(38, 3, 4), (37, 3, 4)])
+        self.assertEqual(sk.cells[0][0].tolist(), [[63, 80, 28, 8], [97, 80, 28, 8], [132, 80, 27, 8]])
+
+        # The rows repeat at the stride, and every cell fits in its box
+        self.assertTrue(set(np.diff(sk.cells[0][:, 0, 1]).tolist()) <= {16, 17})
+        for cells, table in zip(sk.cells, sk.tables):
+            self.assertTrue((cells[..., 0] + cells[..., 2] <= table.w).all())
+            self.assertTrue((cells[..., 1] + cells[..., 3] <= table.h).all())
+            # Clear of the bottom ruling line
+            bottom = table.h - sk.RULE_WIDTH - sk.CELL_MARGIN
+            self.assertTrue((cells[..., 1] + cells[..., 3] <= bottom).all())
+
+        with self.subTest("Math"):
+            sk = ScoreKey('m')
+            self.assertEqual([c.shape for c in sk.cells], [(30, 7, 4), (30, 7, 4)])
+            self.assertEqual(sk.cells[0][0, 0, 1], 91)
+
+
+    def method_get_category_matrix(self):
+        sk = self.scoreKey
+        marked = sk.get_category_matrix()
+        self.assertEqual(marked.dtype, bool)
+        self.assertEqual(marked.shape, (sk.num_questions, len(sk.column_names) - 1))
+        # Every English question has exactly 1 category
+        self.assertEqual(marked.sum(axis=1).tolist(), [1] * 75)
+        self.assertEqual(marked[0].tolist(), [False, False, True])
+
+        with self.subTest("Sampled cells"):
+            counts = sk.sample_cells(sk.images[0], sk.cells[0])
+            self.assertEqual(counts.shape, (38, 3))
+            self.assertEqual(counts[~marked[:38]].max(), 0)
+            self.assertGreaterEqual(counts[marked[:38]].min(), sk.MIN_CELL_INK)
+
+        with self.subTest("Dewarped page"):
+            # Resampling spreads the bottom ruling lines, which mustn't 
+            # reach the cells of the last rows
+            for angle in (0.1, -0.5, 1.5):
+                for ref, sk in self.dewarp_rotated("../images/skr.png", ['r', 's'], angle):
+                    np.testing.assert_array_equal(sk.get_category_matrix(), ref.get_category_matrix())
+
+        with self.subTest("Blank boxes"):
+            sk.images = [np.full_like(image, 255) for image in sk.images]
+            self.assertFalse(sk.get_category_matrix().any())
+
+
+    def method_score_cells(self):
+        sk = self.scoreKey
+        scores = sk.score_cells()
+        self.assertEqual(scores.shape, (sk.num_questions, len(sk.column_names) - 1))
+        np.testing.assert_array_equal(scores >= 0.5, sk.get_category_matrix())
+        # The marks of the clean Scoring Key are all certain
+        self.assertEqual(set(np.round(scores, 2).ravel().tolist()), {0.0, 1.0})
+        self.assertEqual(sk.uncertain_cells(scores), [])
+
+        with self.subTest("Low confidence"):
+            image = sk.images[0].copy()
+            x, y, w, h = sk.cells[0][1, 0].tolist()  # Question 2 'POW', unmarked
+            cv2.rectangle(image, (x, y+3), (x+9, y+4), (0, 0, 0), -1)  # A short line
+            x, y, w, h = sk.cells[0][3, 1].tolist()  # Question 4 'KLA', unmarked
+            cv2.rectangle(image, (x, y), (x+w-1, y+h-1), (0, 0, 0), -1)  # A blot
+            sk.images[0] = image
+
+            scores = sk.score_cells()
+            self.assertAlmostEqual(scores[1, 0], 0.5)
+            self.assertAlmostEqual(scores[3, 1], 3 / 8)  # Spread over the 8 rows of the band
+            self.assertEqual(sk.uncertain_cells(scores), [(2, 'POW', 0.5), (4, 'KLA', 0.375)])
+
+        with self.subTest("Dewarped page"):
+            for ref, sk in self.dewarp_rotated("../images/skr.png", ['r', 's'], 0.7):
+                marked = ref.get_category_matrix()
+                scores = sk.score_cells()
+                np.testing.assert_array_equal(scores >= 0.5, marked)
+                self.assertEqual(sk.uncertain_cells(scores, sk.get_category_matrix()), [])
+
+                # Bands moved onto the bottom ruling lines, whose resampled 
+                # edges are inked in every column, score 0 & are flagged
+                for cells, table in zip(sk.cells, sk.tables):
+                    cells[-1, :, 1] = table.h - sk.RULE_WIDTH - sk.CELL_HEIGHT // 2
+                    cells[-1, :, 3] = sk.CELL_HEIGHT
+                scores = sk.score_cells()
+                self.assertEqual(scores[[19, 39]].max(), 0)
+                self.assertTrue(sk.get_category_matrix()[[19, 39]].any())
+                flagged = sk.uncertain_cells(scores, sk.get_category_matrix())
+                self.assertEqual({q for q, _, _ in flagged}, {20, 40})
+                self.assertEqual(len(flagged), sk.get_category_matrix()[[19, 39]].sum())
+
+
 ### End ScoreKey
   
 
@@ -265,9 +522,17 @@ def suite():
 
     suite.addTest(TestCaseScoreKey('test_instantiation'))
     suite.addTest(TestCaseScoreKey('method_load_page'))
+    suite.addTest(TestCaseScoreKey('method_load_images'))
     suite.addTest(TestCaseScoreKey('method_get_contours'))
     suite.addTest(TestCaseScoreKey('method_filter_markers'))
     suite.addTest(TestCaseScoreKey('method_extract_markers'))
+    suite.addTest(TestCaseScoreKey('method_marker_mask'))
+    suite.addTest(TestCaseScoreKey('method_extract_marker_boxes'))
+    suite.addTest(TestCaseScoreKey('method_get_components'))
+    suite.addTest(TestCaseScoreKey('method_detect_grid'))
+    suite.addTest(TestCaseScoreKey('method_get_cells'))
+    suite.addTest(TestCaseScoreKey('method_get_category_matrix'))
+    suite.addTest(TestCaseScoreKey('method_score_cells'))
 
     suite.addTest(TestCaseColumn('test_instantiation'))
 